@@ -1,21 +1,41 @@
+import click
 from flask import Flask
 from config import Config
 from models import db
 from routes import bp
+from cache import house_cache, search_cache
+from availability import template_cache
+from columnar import columnar_index
+from serializers import FastJSONProvider
+from query_stats import query_stats
+import replicas
 from flask_cors import CORS
 
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 # enables CORS for every route – when we go to production and host the backend/frontend on a VM, we should update this to only allow access from a specific domain
 CORS(app)
 app.config.from_object(Config)
 
 db.init_app(app)
+replicas.init_app(app, db)
+house_cache.init_app(app)
+search_cache.init_app(app)
+template_cache.init_app(app)
+columnar_index.init_app(app)
+query_stats.init_app(app)
 
-with app.app_context():
+app.register_blueprint(bp)
+
+
+# the schema is set up once with `flask --app app init-db` instead of on every start, so booting a worker doesn't
+# connect to the database (connections are opened by the first request that needs one)
+@app.cli.command('init-db')
+def init_db():
     db.create_all()  # Create tables if not exist
+    click.echo('Created the missing tables. Changes to existing tables are applied with the scripts in migrations/.')
 
-app.register_blueprint(bp)
 
 if __name__ == '__main__':
     app.run(debug=True)
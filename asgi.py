@@ -0,0 +1,8 @@
+# async entry point, served by uvicorn:
+#     uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 4
+# GET /houses/search, /houses and /houses/availability are answered on the event loop with SQLAlchemy's asyncio engine
+# (see async_routes.py), every other request goes to the Flask app
+from app import app as flask_app
+from async_routes import AsyncApp
+
+app = AsyncApp(flask_app)
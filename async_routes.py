@@ -0,0 +1,324 @@
+import asyncio
+import contextvars
+from datetime import datetime, timedelta
+import io
+import random
+import sys
+import uuid
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from flask import jsonify, request
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from availability import booked_by_house, booked_statement, cache_templates, slot_grids, template_cache, \
+    templates_statement
+from cache import house_cache, search_cache
+from columnar import columnar_index
+from models import House, db
+from replicas import REPLICA_PREFIX
+from search import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SORT_COLUMNS, SORT_KEYS, build_search_query, house_detail,
+                    house_detail_query, house_dict, house_view, ids_query, in_id_order, next_page_cursor,
+                    order_and_seek, parse_attribute_filters, parse_fields, parse_geo, search_cache_key)
+
+# asyncio drivers replacing the drivers of SQLALCHEMY_DATABASE_URI and the replica URIs
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+}
+
+
+class AsyncDatabase:
+    # asyncio engines for the primary database and its read replicas, opened from the same URIs as db (with the
+    # drivers of ASYNC_DRIVERS) and configured by SQLALCHEMY_ASYNC_ENGINE_OPTIONS. Like replicas.RoutingSession, reads
+    # go to a random replica while fills of caches shared by every request read the primary
+    def __init__(self):
+        self.engines = {}
+        self._replicas = []
+
+    def init_app(self, app):
+        options = app.config.get('SQLALCHEMY_ASYNC_ENGINE_OPTIONS') or {}
+        with app.app_context():
+            # db.engines holds the URIs as resolved by Flask-SQLAlchemy (e.g. relative SQLite paths)
+            urls = {key: engine.url for key, engine in db.engines.items()
+                    if key is None or key.startswith(REPLICA_PREFIX)}
+        self.engines = {key: self._engine(url, options) for key, url in urls.items()}
+        self._replicas = [key for key in self.engines if key is not None]
+
+    def _engine(self, url, options):
+        url = url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+        if url.drivername == 'sqlite+aiosqlite':
+            # aiosqlite defaults to NullPool, the sync driver pools connections to a database file
+            options = dict(options, poolclass=AsyncAdaptedQueuePool)
+        return create_async_engine(url, **options)
+
+    @property
+    def replicated(self):
+        # whether reads go to replicas, i.e. session() and session(primary=True) use different pools
+        return bool(self._replicas)
+
+    def session(self, primary=False):
+        key = None if primary or not self._replicas else random.choice(self._replicas)
+        return AsyncSession(self.engines[key], expire_on_commit=False)
+
+    async def dispose(self):
+        for engine in self.engines.values():
+            await engine.dispose()
+
+
+async_db = AsyncDatabase()
+
+
+# async versions of the GET handlers of routes.bp that spend most of their time waiting on the database. They run in
+# the request context of the Flask app but on the event loop of AsyncApp, so a process keeps as many queries in flight
+# as it has requests instead of one per thread. Only the common cases are answered here: a handler returns None for
+# anything else (invalid parameters, map searches, facets, streaming, the columnar engine, ...) and the request goes
+# to the Flask view, which stays the reference implementation and produces the error responses
+async def search_houses():
+    house_type = request.args.get('type')
+    property_type = request.args.get('property_type')
+    city = request.args.get('city')
+    price_min = request.args.get('price_min', type=int)
+    price_max = request.args.get('price_max', type=int)
+    q = (request.args.get('q') or '').strip()
+    sort = request.args.get('sort') or ('relevance' if q else 'house_id')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    fields = request.args.get('fields')
+
+    if house_type not in ['rental', 'for_sale'] or request.args.get('format') == 'ndjson' \
+            or request.args.get('facets') or sort not in SORT_KEYS or sort == 'distance' \
+            or (sort == 'relevance' and not q) or (limit is not None and not 0 < limit <= MAX_PAGE_SIZE) \
+            or columnar_index.handles(sort, q):
+        return None
+
+    try:
+        bbox, _, _ = parse_geo(request.args)
+        if bbox is not None:
+            return None
+        filters = parse_attribute_filters(request.args)
+        # the cursor of a sort column left out by 'fields' is read with another (sync) query, see search.sort_value
+        if fields and sort in SORT_COLUMNS and SORT_COLUMNS[sort][0] not in ['price', *parse_fields(fields)]:
+            return None
+        query = build_search_query(house_type, property_type, city, price_min, price_max, fields, q, filters=filters)
+        queries = order_and_seek(query, house_type, sort, cursor, q)
+    except ValueError:
+        return None
+
+    page_size = limit or DEFAULT_PAGE_SIZE
+    cache_key = search_cache_key(house_type, property_type, city, price_min, price_max, sort, cursor, page_size, q,
+                                 filters=filters)
+    cached = search_cache.get(cache_key)
+    async with async_db.session() as session:
+        if cached is not None:
+            house_ids = [bytes.fromhex(house_id) for house_id in cached['ids']]
+            result = await session.execute(ids_query(house_type, house_ids, fields).statement)
+            houses = in_id_order(result.unique().scalars().all(), house_ids)
+            next_cursor = cached['next_cursor']
+        else:
+            # fetch one extra row to know whether there is a next page, same as search.first_rows
+            houses = []
+            for query in queries:
+                if len(houses) > page_size:
+                    break
+                result = await session.execute(query.limit(page_size + 1 - len(houses)).statement)
+                houses += result.unique().scalars().all()
+            next_cursor = next_page_cursor(sort, houses[page_size - 1], house_type, cursor, page_size) \
+                if len(houses) > page_size else None
+            houses = houses[:page_size]
+            search_cache.set(cache_key, {'ids': [house.house_id.hex() for house in houses],
+                                         'next_cursor': next_cursor})
+
+    if not houses:
+        return jsonify({
+            'success': True,
+            'message': 'No houses found matching the criteria.',
+            'data': [],
+            'next_cursor': None,
+            'facets': None}), 200
+
+    return jsonify({
+        'success': True,
+        'message': "Found houses matching the criteria",
+        'data': [house_dict(house, house_type) for house in houses],
+        'next_cursor': next_cursor,
+        'facets': None
+    }), 200
+
+
+async def house_by_id():
+    fields = request.args.get('fields')
+    try:
+        house_id = uuid.UUID(request.args.get('house_id')).bytes
+        if fields:
+            parse_fields(fields)
+    except (TypeError, ValueError):
+        return None
+
+    # same cache entries as the Flask view, filled from the primary
+    key = str(uuid.UUID(bytes=house_id))
+    data = house_cache.get(key)
+    if data is None:
+        async with async_db.session(primary=True) as session:
+            result = await session.execute(house_detail_query(house_id).statement)
+            data = house_detail(result.unique().scalar_one_or_none())
+        if data is not None:
+            house_cache.set(key, data)
+
+    if not data:
+        return jsonify({
+            'success': False,
+            'message': 'House not found.',
+            'data': None}), 404
+
+    return jsonify({
+        'success': True,
+        'message': 'House data found',
+        'data': house_view(data, fields, request.args.get('include_agent', '').lower() in ('1', 'true', 'yes'))
+    }), 200
+
+
+async def house_availability():
+    try:
+        house_id = uuid.UUID(request.args.get('house_id')).bytes
+        start_date = datetime.fromisoformat(request.args.get('date')).date()
+        num_days = int(request.args.get('days'))
+    except (TypeError, ValueError):
+        return None
+    if num_days <= 0:
+        return None
+
+    async with async_db.session() as session:
+        house_exists = (await session.execute(db.select(House.house_id).filter_by(house_id=house_id))).first()
+        if not house_exists:
+            return jsonify({
+                'success': False,
+                'message': 'House not found.'
+            }), 404
+
+        # templates missing from template_cache are read from the primary
+        async def load_templates(primary):
+            templates, missing, generation = template_cache.get_many([house_id])
+            if missing:
+                patterns = (await primary.execute(templates_statement(missing))).scalars().all()
+                templates.update(cache_templates(missing, patterns, generation))
+            return templates
+
+        end_date = start_date + timedelta(days=num_days)
+        appointments_statement = booked_statement([house_id], start_date, end_date)
+        if async_db.replicated:
+            # at the same time as the appointments are read from a replica. A primary connection is only ever taken
+            # while holding a replica one, never the other way round, so requests can't wait on each other's
+            async with async_db.session(primary=True) as primary:
+                templates, appointments = await asyncio.gather(load_templates(primary),
+                                                               session.execute(appointments_statement))
+        else:
+            # session is on the primary already. A second connection from the same pool would deadlock once every
+            # connection is held by a request waiting for its second one
+            appointments = await session.execute(appointments_statement)
+            templates = await load_templates(session)
+        booked = booked_by_house([house_id], appointments.all())
+
+    return jsonify({
+        'success': True,
+        'data': slot_grids([house_id], start_date, num_days, templates, booked)[house_id]
+    }), 200
+
+
+# path: handler of the GET requests answered by AsyncApp
+ASYNC_VIEWS = {
+    '/houses/search': search_houses,
+    '/houses': house_by_id,
+    '/houses/availability': house_availability,
+}
+
+
+def _environ(scope):
+    # WSGI environ of an ASGI http scope, enough for a Flask request context (the GET handlers don't read a body)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin1'),
+        'PATH_INFO': scope['path'].encode().decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'SERVER_NAME': scope['server'][0] if scope.get('server') else 'localhost',
+        'SERVER_PORT': str(scope['server'][1]) if scope.get('server') else '80',
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else None,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+class AsyncApp:
+    # ASGI application serving the ASYNC_VIEWS handlers on the event loop and every other request with the Flask app
+    # (in a thread, through asgiref's WsgiToAsgi). The async handlers run after the app's before_request hooks, which
+    # may answer in their place, and their responses go through its after_request hooks (e.g. CORS) like those of the
+    # Flask views; a request an async handler hands over to Flask runs the before_request hooks again there. The caches
+    # are the app's: the memory backend (default) never blocks, the redis one holds up the loop for a round trip per
+    # lookup
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        async_db.init_app(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        view = ASYNC_VIEWS.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+        if view is not None:
+            response = None
+            with self.app.request_context(_environ(scope)):
+                try:
+                    rv = self.app.preprocess_request()
+                    if rv is None:
+                        rv = await view()
+                    if rv is not None:
+                        response = self.app.finalize_request(rv)
+                except Exception as e:
+                    response = self.app.finalize_request(self.app.handle_exception(e), from_error_handler=True)
+            if response is not None:
+                return await self._send(send, response)
+
+        # in a context of its own: uvicorn starts the next request of a keep-alive connection from the send() ending the
+        # previous response, whose context may still point asgiref at the executor of a finished WsgiToAsgi thread
+        await contextvars.Context().run(asyncio.ensure_future, self._wsgi(scope, receive, send))
+
+    async def _wsgi(self, scope, receive, send):
+        # a thread per request, without a ThreadSensitiveContext asgiref runs every WSGI request on one shared thread
+        async with ThreadSensitiveContext():
+            await self.wsgi(scope, receive, send)
+
+    async def _send(self, send, response):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                        for name, value in response.headers.items()]
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_db.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
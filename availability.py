@@ -0,0 +1,304 @@
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+import threading
+import time
+import uuid
+
+from cache import ReadThroughCache
+from models import Appointment, AppointmentSlot, ListingAvailability, db
+
+# length of a single bookable block in seconds (15 minutes)
+SLOT_SECONDS = 15 * 60
+
+# max number of houses whose weekly templates are kept in memory
+TEMPLATE_CACHE_SIZE = 1024
+
+# seconds a template is used before it is read again (see TemplateCache)
+TEMPLATE_CACHE_TTL = 60
+
+
+def _seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def on_grid(t):
+    # whether t starts one of the 15 minute blocks counted from midnight. Bookings have to: the blocks of one off the
+    # grid (e.g. 10:07-10:22 takes 10:00 and 10:15) would also be claimed by neighbours it doesn't overlap (10:22-10:37)
+    return _seconds(t) % SLOT_SECONDS == 0
+
+
+def slot_claims(appt_id, house_id, appt_date, start_time, end_time):
+    # AppointmentSlot rows of an appointment: every 15 minute block since midnight that [start_time, end_time) touches.
+    # Bookings start on a block (see on_grid), appointments stored before that may take one block more
+    start = _seconds(start_time)
+    end = _seconds(end_time)
+    if end <= start:
+        # ends after midnight, the blocks are still counted from the start date
+        end += 24 * 3600
+    return [{'house_id': house_id, 'date': appt_date, 'slot': slot, 'appt_id': appt_id}
+            for slot in range(start // SLOT_SECONDS, -(-end // SLOT_SECONDS))]
+
+
+def slots_taken(claims):
+    # whether any of the blocks of claims (see slot_claims) belongs to a committed appointment
+    return AppointmentSlot.query.with_entities(AppointmentSlot.appt_id).filter(db.or_(*(
+        (AppointmentSlot.house_id == claim['house_id']) & (AppointmentSlot.date == claim['date']) &
+        (AppointmentSlot.slot == claim['slot']) for claim in claims))).first() is not None
+
+
+def release_slots(appt_ids):
+    # removes the AppointmentSlot rows of appt_ids (a list or a SELECT of appt_ids), before the appointments themselves
+    AppointmentSlot.query.filter(AppointmentSlot.appt_id.in_(appt_ids)).delete(synchronize_session=False)
+
+
+@lru_cache(maxsize=None)
+def _label(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}"
+
+
+def _window_mask(pattern):
+    # converts an availability window into (anchor, mask). A day is split into 96 blocks of 15 minutes, bit i of mask is
+    # set if the block starting at i * 15 minutes + anchor is available. anchor is the offset of the window's start
+    # time into its 15 minute block and is 0 unless the window starts at an odd time (e.g. 09:05)
+    start = _seconds(pattern.start_time)
+    end = _seconds(pattern.end_time)
+    anchor = start % SLOT_SECONDS
+    if end <= start:
+        return anchor, 0
+    count = -(-(end - start) // SLOT_SECONDS)
+    return anchor, ((1 << count) - 1) << (start // SLOT_SECONDS)
+
+
+def _booked_mask(anchor, booked):
+    # converts a set of appointment start times (in seconds since midnight) into a mask on the same grid as the
+    # availability window. appointments that don't start on a block boundary never mark a block as booked
+    mask = 0
+    for seconds in booked:
+        if seconds >= anchor and (seconds - anchor) % SLOT_SECONDS == 0:
+            mask |= 1 << ((seconds - anchor) // SLOT_SECONDS)
+    return mask
+
+
+def _slots(window, booked):
+    # yields (seconds since midnight, is_booked) for every 15 minute block in a single availability window
+    anchor, mask = window
+    booked_mask = _booked_mask(anchor, booked) if booked else 0
+    while mask:
+        low = mask & -mask
+        yield (low.bit_length() - 1) * SLOT_SECONDS + anchor, bool(booked_mask & low)
+        mask ^= low
+
+
+class TemplateCache:
+    # LRU cache of per-house availability templates. A template is (by_date, by_weekday) where by_date holds the
+    # one-time availabilities and by_weekday the recurring ones, both mapping to (anchor, mask) windows. Entries must be
+    # invalidated whenever a house's ListingAvailability rows change (after the commit).
+    # Every entry is tagged with its house's generation in `versions`, read before its rows were loaded, and is only
+    # used while that generation is current and for at most ttl seconds. invalidate() starts a new generation for the
+    # house, so a template loaded from rows read before the invalidation is never served and other houses stay cached.
+    # With the redis cache backend the generations are shared and an invalidation reaches every worker at once; with
+    # the memory backend other workers pick up changes after ttl
+    def __init__(self, max_size=TEMPLATE_CACHE_SIZE, ttl=TEMPLATE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.versions = ReadThroughCache('availability', ttl_config='AVAILABILITY_CACHE_TTL')
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('AVAILABILITY_CACHE_TTL', TEMPLATE_CACHE_TTL)
+        self.versions.init_app(app)
+
+    def get_many(self, house_ids):
+        # returns ({house_id: template} for cached houses, [house_ids that need to be loaded], {house_id: generation}).
+        # The missing templates are stored with put_many(..., generation)
+        generation = dict(zip(house_ids, self.versions.generations([house_id.hex() for house_id in house_ids])))
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for house_id in house_ids:
+                entry = self._entries.get(house_id)
+                if entry is None or entry[1] != generation[house_id] or entry[2] < now:
+                    self.misses += 1
+                    missing.append(house_id)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(house_id)
+                    found[house_id] = entry[0]
+        return found, missing, generation
+
+    def put_many(self, templates, generation):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for house_id, template in templates.items():
+                self._entries[house_id] = (template, generation[house_id], expires)
+                self._entries.move_to_end(house_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, house_id):
+        with self._lock:
+            self._entries.pop(house_id, None)
+        self.versions.bump(house_id.hex())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+template_cache = TemplateCache()
+
+
+def templates_statement(house_ids):
+    # SELECT of the ListingAvailability rows of the houses whose templates aren't cached, see cache_templates
+    return db.select(ListingAvailability).where(ListingAvailability.house_id.in_(house_ids))
+
+
+def cache_templates(house_ids, patterns, generation):
+    # builds the templates of house_ids from their ListingAvailability rows, caches them under the generation returned by
+    # template_cache.get_many and returns them. A one-time availability (available_date) takes precedence over the
+    # recurring pattern for that weekday. setdefault keeps the first row per key, matching the old .first() lookups
+    loaded = {house_id: ({}, {}) for house_id in house_ids}
+    for pattern in patterns:
+        by_date, by_weekday = loaded[pattern.house_id]
+        if pattern.available_date is not None:
+            by_date.setdefault(pattern.available_date, _window_mask(pattern))
+        if pattern.day_of_the_week is not None:
+            by_weekday.setdefault(pattern.day_of_the_week, _window_mask(pattern))
+
+    template_cache.put_many(loaded, generation)
+    return loaded
+
+
+def _load_templates(house_ids):
+    # returns {house_id: (by_date, by_weekday)}, loading the houses that aren't cached yet with a single IN (...) query
+    templates, missing, generation = template_cache.get_many(house_ids)
+    if not missing:
+        return templates
+
+    # read from the primary, a lagging replica would leave an outdated template in the cache until the house's
+    # availability changes again
+    with db.session().on_primary():
+        patterns = db.session.execute(templates_statement(missing)).scalars().all()
+    templates.update(cache_templates(missing, patterns, generation))
+    return templates
+
+
+def booked_statement(house_ids, start_date, end_date):
+    # SELECT of the appointments of house_ids in [start_date, end_date), see booked_by_house
+    return db.select(Appointment.house_id, Appointment.date, Appointment.start_time).where(
+        Appointment.house_id.in_(house_ids), Appointment.date >= start_date, Appointment.date < end_date)
+
+
+def booked_by_house(house_ids, appointments):
+    # returns {house_id: {date: set of appointment start times in seconds}} from the rows of booked_statement
+    booked = {house_id: {} for house_id in house_ids}
+    for house_id, appt_date, appt_start in appointments:
+        booked[house_id].setdefault(appt_date, set()).add(_seconds(appt_start))
+    return booked
+
+
+def _load_booked(house_ids, start_date, end_date):
+    # returns {house_id: {date: set of appointment start times in seconds}} using one IN (...) query
+    return booked_by_house(house_ids, db.session.execute(booked_statement(house_ids, start_date, end_date)).all())
+
+
+def _days(start_date, num_days, template, booked):
+    # yields (date, window, booked start times) for each day, window is None if nothing is configured for that day
+    by_date, by_weekday = template
+    for x in range(num_days):
+        cur_date = start_date + timedelta(days=x)
+        # we call datetime.weekday() here: "Return the day of the week as an integer, where Monday is 0 and Sunday is 6."
+        window = by_date.get(cur_date) or by_weekday.get(cur_date.weekday())
+        yield cur_date, window, booked.get(cur_date, ())
+
+
+def _grid(start_date, num_days, template, booked):
+    availability_results = {}
+    for cur_date, window, booked_today in _days(start_date, num_days, template, booked):
+        time_blocks = []
+        if window is not None:
+            for seconds, is_booked in _slots(window, booked_today):
+                time_blocks.append(f"{_label(seconds)} {'Booked' if is_booked else 'Free'}")
+        availability_results[cur_date.isoformat()] = time_blocks
+    return availability_results
+
+
+def _first_free(start_date, num_days, template, booked):
+    for cur_date, window, booked_today in _days(start_date, num_days, template, booked):
+        if window is None:
+            continue
+        anchor, mask = window
+        free = mask & ~_booked_mask(anchor, booked_today)
+        if free:
+            seconds = ((free & -free).bit_length() - 1) * SLOT_SECONDS + anchor
+            return {'date': cur_date.isoformat(), 'time': _label(seconds)}
+    return None
+
+
+def house_slot_grids(house_ids, start_date, num_days, first_free=False):
+    # computes the 15 minute availability grid for every house in house_ids over [start_date, start_date + num_days)
+    # with a fixed number of queries, independent of both num_days and len(house_ids). Availability patterns come from
+    # template_cache, so a warm request only queries the appointments. if first_free is set, only the earliest free
+    # slot ({'date', 'time'} or None) is returned for each house instead of the full grid
+    end_date = start_date + timedelta(days=num_days)
+    templates = _load_templates(house_ids)
+    booked = _load_booked(house_ids, start_date, end_date)
+    return slot_grids(house_ids, start_date, num_days, templates, booked, first_free)
+
+
+def slot_grids(house_ids, start_date, num_days, templates, booked, first_free=False):
+    # the results of house_slot_grids from already loaded templates and appointments
+    build = _first_free if first_free else _grid
+    return {house_id: build(start_date, num_days, templates[house_id], booked[house_id]) for house_id in house_ids}
+
+
+def house_slot_grid(house_id, start_date, num_days):
+    # computes the 15 minute availability grid for a single house, see house_slot_grids
+    return house_slot_grids([house_id], start_date, num_days)[house_id]
+
+
+def _weekday_of(column):
+    # day of the week of a date column as 0-Monday ... 6-Sunday, same as date.weekday()
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return (db.cast(db.func.strftime('%w', column), db.Integer) + 6) % 7
+    return db.func.weekday(column)
+
+
+def cancel_outside_window(house_id, start_time, end_time, on_date=None, weekday=None, delete=True):
+    # finds the appointments of a house that don't fit into [start_time, end_time), either on on_date or on every date
+    # falling on weekday that isn't overridden by a one-time availability. Only the user_ids are selected and the
+    # appointments are removed with a single DELETE (unless delete is False), so the cost only depends on the number of
+    # affected rows. Returns the user_ids of the affected clients
+    criteria = [
+        Appointment.house_id == house_id,
+        (Appointment.start_time < start_time) | (Appointment.end_time > end_time)
+    ]
+    if on_date is not None:
+        criteria.append(Appointment.date == on_date)
+    else:
+        overridden = db.select(ListingAvailability.available_date).where(
+            ListingAvailability.house_id == house_id, ListingAvailability.available_date.isnot(None))
+        criteria += [_weekday_of(Appointment.date) == weekday, Appointment.date.notin_(overridden)]
+
+    user_ids = [str(uuid.UUID(bytes=user_id)) for (user_id,) in
+                Appointment.query.with_entities(Appointment.user_id).filter(*criteria).all()]
+    if delete and user_ids:
+        release_slots(db.select(Appointment.appt_id).where(*criteria))
+        Appointment.query.filter(*criteria).delete(synchronize_session=False)
+    return user_ids
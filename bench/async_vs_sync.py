@@ -0,0 +1,77 @@
+# req/s of the sync server (gunicorn gthread workers running wsgi:app) next to the async one (uvicorn running asgi:app)
+# under many concurrent clients, on the GET requests asgi.py answers on its event loop: 40% searches, 30% house details
+# and 30% availabilities. The caches are off and every SQL statement waits --latency-ms (see sql_latency.py) to stand in
+# for the round trip to MySQL, so the servers spend their time waiting on the database like they would in production:
+#     python bench/async_vs_sync.py --concurrency 50,200 --threads 4,64 --latency-ms 20
+import json
+import random
+import sys
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from common import (CITIES, PROPERTY_TYPES, arguments, free_port, load, load_app, seed_agent, seed_houses, serve,
+                    summary)
+
+# the servers' settings: no caching, and the delay of sql_latency.py
+CACHES_OFF = {'CACHE_TTL': '0', 'SEARCH_CACHE_TTL': '0', 'AVAILABILITY_CACHE_TTL': '0'}
+
+
+def servers(args, port):
+    # (name, command, environment) of every compared server
+    gunicorn = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--pythonpath', 'bench', '--bind',
+                f'127.0.0.1:{port}', '--workers', str(args.workers), '--access-logfile', '/dev/null']
+    for threads in args.threads:
+        # one pooled connection per thread, see gunicorn.conf.py
+        yield (f'gunicorn gthread, {args.workers} worker(s) x {threads} threads',
+               gunicorn + ['--threads', str(threads), 'sql_latency:app'], {'DB_POOL_SIZE': str(threads)})
+    yield (f'uvicorn asgi:app, {args.workers} worker(s)',
+           [sys.executable, '-m', 'uvicorn', '--app-dir', 'bench', 'sql_latency:asgi_app', '--port', str(port),
+            '--workers', str(args.workers), '--no-access-log'], {})
+
+
+def request_mix(url, rng):
+    # the path of the next request: a search, a house or its availability
+    with urlopen(f'{url}/houses/search?type=rental&limit=500') as response:
+        house_ids = [house['house_id'] for house in json.load(response)['data']]
+
+    def next_path():
+        draw = rng.random()
+        if draw < 0.4:
+            return '/houses/search?' + urlencode({'type': 'rental', 'city': rng.choice(CITIES),
+                                                  'property_type': rng.choice(PROPERTY_TYPES), 'limit': 20})
+        if draw < 0.7:
+            return f'/houses?house_id={rng.choice(house_ids)}'
+        return f'/houses/availability?house_id={rng.choice(house_ids)}&date=2030-01-01&days=7'
+    return next_path
+
+
+def main():
+    parser = arguments('Compares the throughput of the sync and async servers at high concurrency.')
+    parser.add_argument('--houses', type=int, default=3000, help='number of listings to fill the database with')
+    parser.add_argument('--concurrency', default='50,200', help='comma separated numbers of concurrent clients')
+    parser.add_argument('--threads', default='4,64', help='comma separated threads per gunicorn worker to compare')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes of every server')
+    parser.add_argument('--latency-ms', type=float, default=20, help='delay added to every SQL statement')
+    parser.add_argument('--duration', type=float, default=10, help='seconds every server is loaded for')
+    args = parser.parse_args()
+    args.threads = [int(threads) for threads in args.threads.split(',')]
+    concurrencies = [int(concurrency) for concurrency in args.concurrency.split(',')]
+
+    app = load_app(args.database)
+    with app.app_context():
+        seed_houses(args.houses, seed_agent())
+
+    print(f'{args.houses} houses, {args.latency_ms:g} ms per SQL statement, {args.duration:g} s per measurement')
+    port = free_port()
+    env = dict(CACHES_OFF, BENCH_SQL_LATENCY_MS=str(args.latency_ms))
+    for name, command, settings in servers(args, port):
+        with serve(command, port, dict(env, **settings)) as url:
+            next_path = request_mix(url, random.Random(0))
+            for concurrency in concurrencies:
+                rate, latencies, failures = load(url, next_path, concurrency, args.duration)
+                timing = summary(latencies) if latencies else 'no successful request'
+                print(f'{name:<40} {concurrency:>4} clients {rate:8.0f} req/s   {timing}   {failures} failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# POST /houses/appointment latency as the appointments table grows. The table is filled up to each of --sizes
+# appointments (spread over --houses houses), then new bookings and bookings rejected as overlapping are timed. With the
+# check scoped to (house_id, date) and served by an index, both should stay flat however large the table gets:
+#     python bench/booking_latency.py --sizes 10000,100000,1000000
+from datetime import date, datetime, time, timedelta
+import itertools
+import random
+import uuid
+
+from common import arguments, load_app, measure, seed_agent, seed_houses, seed_users, summary
+
+FIRST_DAY = date(2030, 1, 1)
+# the timed bookings are made on days after the seeded ones
+BOOKING_DAY = date(2040, 1, 1)
+SLOTS_PER_DAY = 32  # seeded appointments run from 08:00 to 16:00
+
+
+def seed_appointments(first, count, house_ids, user_id, batch=10000):
+    # inserts appointments number first to first + count with their AppointmentSlot rows. Appointment n is on house
+    # n % len(house_ids), on the n // len(house_ids)-th 15 minute block counted from 08:00 on FIRST_DAY
+    from availability import slot_claims
+    from models import Appointment, AppointmentSlot, db
+
+    for start in range(first, first + count, batch):
+        appointments = []
+        claims = []
+        for n in range(start, min(start + batch, first + count)):
+            house_id = house_ids[n % len(house_ids)]
+            block = n // len(house_ids)
+            begin = datetime.combine(FIRST_DAY + timedelta(days=block // SLOTS_PER_DAY), time(8)) + \
+                timedelta(minutes=15 * (block % SLOTS_PER_DAY))
+            appt_id = uuid.uuid4().bytes
+            appointments.append({'appt_id': appt_id, 'house_id': house_id, 'user_id': user_id, 'date': begin.date(),
+                                 'start_time': begin.time(), 'end_time': (begin + timedelta(minutes=15)).time()})
+            claims += slot_claims(appt_id, house_id, begin.date(), begin.time(), appointments[-1]['end_time'])
+        db.session.execute(Appointment.__table__.insert(), appointments)
+        db.session.execute(AppointmentSlot.__table__.insert(), claims)
+        db.session.commit()
+
+
+def main():
+    parser = arguments('Times appointment bookings while the appointments table grows.', repeat=200)
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated numbers of appointments to time the bookings at')
+    parser.add_argument('--houses', type=int, default=1000, help='number of houses the appointments are spread over')
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    app = load_app(args.database)
+    from models import Client
+
+    client = app.test_client()
+    with app.app_context():
+        house_ids = seed_houses(args.houses, seed_agent())
+        user_id = seed_users(1, Client)[0]
+    user_id_str = str(uuid.UUID(bytes=user_id))
+    rng = random.Random(0)
+    # every new booking takes a block nobody has booked yet, the n-th one on the n // 96-th day after BOOKING_DAY
+    free_blocks = itertools.count()
+
+    def new_booking():
+        n = next(free_blocks)
+        response = client.post('/houses/appointment', json={
+            'user_id': user_id_str, 'house_id': str(uuid.UUID(bytes=rng.choice(house_ids))),
+            'date': (BOOKING_DAY + timedelta(days=n // 96)).isoformat(),
+            'start_time': f'{n % 96 // 4:02d}:{n % 4 * 15:02d}:00'})
+        assert response.status_code == 201, response.json
+
+    def overlapping_booking():
+        # 08:00 on FIRST_DAY is taken by the seeded appointment of every house
+        response = client.post('/houses/appointment', json={
+            'user_id': user_id_str, 'house_id': str(uuid.UUID(bytes=rng.choice(house_ids))),
+            'date': FIRST_DAY.isoformat(), 'start_time': '08:00:00'})
+        assert response.status_code == 403, response.json
+
+    seeded = 0
+    print(f'{args.houses} houses, {args.repeat} runs per measurement')
+    for size in sizes:
+        with app.app_context():
+            seed_appointments(seeded, size - seeded, house_ids, user_id)
+        seeded = size
+        print(f'{size:>9} appointments   new booking: {summary(measure(new_booking, args.repeat))}   '
+              f'overlapping: {summary(measure(overlapping_booking, args.repeat))}')
+
+
+if __name__ == '__main__':
+    main()
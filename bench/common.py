@@ -0,0 +1,217 @@
+# helpers shared by the benchmark scripts in this directory. The scripts are run from the repository root, e.g.
+# `python bench/search_indexes.py --rows 100000`, and fill a throwaway SQLite file unless --database points them at
+# another (empty) database
+import argparse
+import contextlib
+from datetime import date, timedelta
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# values of the synthetic listings, searches pick from the same lists
+CITIES = [f'City {i}' for i in range(200)]
+PROPERTY_TYPES = ['apartment', 'condo', 'house', 'townhouse', 'studio']
+PETS = ['cats', 'dogs', 'none']
+
+
+def arguments(description, **defaults):
+    # argument parser with the options every script takes, defaults overrides their default values. --repeat is only
+    # added for the scripts giving it a default, the load tests run for a duration instead
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--database', help='SQLAlchemy URI of an empty database to fill (default: a temporary '
+                                           'SQLite file)')
+    if 'repeat' in defaults:
+        parser.add_argument('--repeat', type=int, default=defaults['repeat'],
+                            help='number of timed runs of every measurement')
+    return parser
+
+
+def database_uri(database=None):
+    return database or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+
+def load_app(database=None, **settings):
+    # imports the app with its tables created. The app reads its configuration when it is imported, so the database and
+    # any other settings (e.g. SEARCH_CACHE_TTL=0 to time uncached requests) are put into the environment first. The
+    # slow query log is off unless asked for, the scripts report their own timings
+    os.environ['SQLALCHEMY_DATABASE_URI'] = database_uri(database)
+    for threshold in ('SLOW_QUERY_MS', 'SLOW_REQUEST_DB_MS', 'SLOW_REQUEST_QUERIES'):
+        settings.setdefault(threshold, 0)
+    os.environ.update({key: str(value) for key, value in settings.items()})
+    sys.path.insert(0, ROOT)
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def seed_agent():
+    # inserts an agent (user + agent row) and returns its user_id, in an app context
+    from models import Agent, User, db
+
+    user_id = uuid.uuid4().bytes
+    db.session.add(User(user_id=user_id, email=f'{uuid.uuid4().hex}@example.com', first_name='Bench',
+                        last_name='Agent'))
+    db.session.add(Agent(user_id=user_id, company_name='Bench Realty'))
+    db.session.commit()
+    return user_id
+
+
+def seed_users(count, model, batch=10000):
+    # inserts count users of model (Agent or Client) with core INSERTs and returns their user_ids, in an app context
+    from models import User, db
+
+    all_ids = []
+    for first in range(0, count, batch):
+        user_ids = [uuid.uuid4().bytes for _ in range(min(batch, count - first))]
+        db.session.execute(User.__table__.insert(), [
+            {'user_id': user_id, 'email': f'{user_id.hex()}@example.com', 'first_name': 'Bench', 'last_name': 'User',
+             'country': 'US', 'language': 'en', 'rating': 5} for user_id in user_ids])
+        db.session.execute(model.__table__.insert(), [{'user_id': user_id} for user_id in user_ids])
+        db.session.commit()
+        all_ids += user_ids
+    return all_ids
+
+
+def house_row(rng, house_id, agent_id):
+    # one synthetic listing with every searchable column set
+    from search import geo_cell
+
+    latitude = rng.uniform(25, 49)
+    longitude = rng.uniform(-124, -67)
+    return {
+        'house_id': house_id, 'street': f'{rng.randrange(1, 9999)} Main St', 'zipcode': rng.randrange(10000, 99999),
+        'country': 'US', 'state': 'TX', 'city': rng.choice(CITIES), 'user_id': agent_id,
+        'description': 'A bright listing with a garden, close to schools and public transport.', 'HOA': 0,
+        'name': f'Listing {house_id.hex()[:8]}', 'bedrooms': rng.randrange(0, 6), 'bathrooms': rng.randrange(1, 4),
+        'square_feet': rng.randrange(300, 5000), 'property_type': rng.choice(PROPERTY_TYPES),
+        'rating': rng.randrange(0, 6), 'num_views': rng.randrange(0, 10000), 'parking_spots': rng.randrange(0, 3),
+        'create_date': date(2020, 1, 1) + timedelta(days=rng.randrange(0, 1800)), 'pets': rng.choice(PETS),
+        'garage': rng.random() < 0.5, 'latitude': latitude, 'longitude': longitude,
+        'geo_cell': geo_cell(latitude, longitude)
+    }
+
+
+def seed_houses(count, agent_id, batch=10000, seed=0):
+    # inserts count synthetic listings, every other one a rental (monthly price 500-5000) and the rest for sale (price
+    # 50000-1000000), with core INSERTs committed batch rows at a time. Returns their house_ids, in an app context
+    from models import ForSale, House, Rental, db
+
+    rng = random.Random(seed)
+    house_ids = []
+    for first in range(0, count, batch):
+        ids = [uuid.uuid4().bytes for _ in range(min(batch, count - first))]
+        db.session.execute(House.__table__.insert(), [house_row(rng, house_id, agent_id) for house_id in ids])
+        db.session.execute(Rental.__table__.insert(), [
+            {'house_id': house_id, 'monthly_price': rng.randrange(500, 5000)} for house_id in ids[::2]])
+        db.session.execute(ForSale.__table__.insert(), [
+            {'house_id': house_id, 'price': rng.randrange(50000, 1000000)} for house_id in ids[1::2]])
+        db.session.commit()
+        house_ids += ids
+    return house_ids
+
+
+def measure(fn, repeat):
+    # calls fn repeat times (after one untimed warm-up call) and returns the latencies in milliseconds
+    fn()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def summary(latencies):
+    return f'median {percentile(latencies, 50):8.2f} ms   p99 {percentile(latencies, 99):8.2f} ms'
+
+
+def free_port():
+    # a local TCP port nothing listens on
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def serve(command, port, env=None, timeout=60):
+    # runs the server command from the repository root until the with block exits and yields its URL once it accepts
+    # connections on port. The server gets this process' environment (and so the database of load_app) updated with
+    # env, its output goes to a log file
+    log = tempfile.NamedTemporaryFile('w', prefix='bench-server-', suffix='.log', delete=False)
+    process = subprocess.Popen(command, cwd=ROOT, env=dict(os.environ, **(env or {})), stdout=log,
+                               stderr=subprocess.STDOUT)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f'{" ".join(command)} did not start, see {log.name}')
+                time.sleep(0.2)
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        process.terminate()
+        process.wait()
+        log.close()
+
+
+def load(url, next_path, concurrency, duration):
+    # concurrency clients, each on a keep-alive connection of its own, send GET requests for next_path() to url for
+    # duration seconds. Returns (requests per second, latencies in milliseconds, failures). A failure is a 5xx response
+    # or a dropped connection, after which the client reconnects
+    target = urlsplit(url)
+    deadline = time.monotonic() + duration
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+        timings = []
+        failed = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request('GET', target.path.rstrip('/') + next_path())
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                continue
+            if response.status >= 500:
+                failed += 1
+            else:
+                timings.append((time.perf_counter() - start) * 1000)
+        connection.close()
+        with lock:
+            latencies.extend(timings)
+            failures.append(failed)
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return len(latencies) / (time.perf_counter() - start), latencies, sum(failures)
@@ -0,0 +1,74 @@
+# req/s and latency of the main read endpoints, each loaded for --duration seconds by --concurrency clients on keep-alive
+# connections. Serves wsgi:app with gunicorn and gunicorn.conf.py (or asgi:app with --server uvicorn) on a database
+# filled with --houses listings, unless --url points it at a server that is already running. The server inherits the
+# environment, e.g. SEARCH_CACHE_TTL=0 to load uncached searches:
+#     python bench/load_test.py --houses 2000 --concurrency 16 --workers 4
+import json
+import random
+import sys
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from common import (CITIES, arguments, free_port, load, load_app, seed_agent, seed_houses, seed_users, serve,
+                    summary)
+
+
+def server_command(server, port, workers):
+    if server == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--workers', str(workers),
+                '--no-access-log']
+    return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', '--workers',
+            str(workers), 'wsgi:app']
+
+
+def endpoints(url, rng):
+    # path generators of the loaded endpoints, the houses are picked among the first rentals the server returns
+    with urlopen(f'{url}/houses/search?type=rental&limit=500') as response:
+        house_ids = [house['house_id'] for house in json.load(response)['data']]
+    if not house_ids:
+        raise SystemExit(f'{url} has no rentals to load.')
+    return {
+        'search': lambda: '/houses/search?' + urlencode({'type': 'rental', 'city': rng.choice(CITIES)}),
+        'house detail': lambda: f'/houses?house_id={rng.choice(house_ids)}',
+        'availability': lambda: f'/houses/availability?house_id={rng.choice(house_ids)}&date=2030-01-01&days=7',
+        'agents': lambda: '/users/agents?limit=50',
+    }
+
+
+def run(url, args):
+    rng = random.Random(0)
+    print(f'{args.concurrency} clients, {args.duration:g} s per endpoint, {url}')
+    for name, next_path in endpoints(url, rng).items():
+        rate, latencies, failures = load(url, next_path, args.concurrency, args.duration)
+        timing = summary(latencies) if latencies else 'no successful request'
+        print(f'{name:<14} {rate:8.0f} req/s   {timing}   {failures} failed')
+
+
+def main():
+    parser = arguments('Loads the main endpoints of a served app and reports req/s and p99 latency.')
+    parser.add_argument('--url', help='base URL of a running server to load instead of starting one')
+    parser.add_argument('--server', choices=['gunicorn', 'uvicorn'], default='gunicorn',
+                        help='server started for the test: gunicorn wsgi:app or uvicorn asgi:app')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes of the started server')
+    parser.add_argument('--houses', type=int, default=2000, help='number of listings to fill the database with')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=5, help='seconds each endpoint is loaded for')
+    args = parser.parse_args()
+
+    if args.url:
+        run(args.url.rstrip('/'), args)
+        return
+
+    app = load_app(args.database)
+    from models import Agent
+
+    with app.app_context():
+        seed_houses(args.houses, seed_agent())
+        seed_users(100, Agent)
+    port = free_port()
+    with serve(server_command(args.server, port, args.workers), port) as url:
+        run(url, args)
+
+
+if __name__ == '__main__':
+    main()
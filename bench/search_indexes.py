@@ -0,0 +1,63 @@
+# /houses/search latency without and with the indexes declared on houses, rentals and for_sale (models.py). Fills the
+# database with --rows synthetic listings, drops those indexes, times every search below, then creates them again and
+# times the same searches. The search cache is turned off so every request reaches the database:
+#     python bench/search_indexes.py --rows 1000000
+from common import CITIES, PROPERTY_TYPES, arguments, load_app, measure, seed_agent, seed_houses, summary
+
+SEARCHES = {
+    'city': {'type': 'rental', 'city': CITIES[7]},
+    'city + property_type': {'type': 'rental', 'city': CITIES[7], 'property_type': PROPERTY_TYPES[2]},
+    'sale price range': {'type': 'for_sale', 'price_min': 200000, 'price_max': 202000},
+    'rent price range': {'type': 'rental', 'price_min': 1500, 'price_max': 1510},
+    'city + rent price range': {'type': 'rental', 'city': CITIES[7], 'price_min': 1000, 'price_max': 2000},
+    'cheapest rentals': {'type': 'rental', 'sort': 'price'},
+}
+
+
+def search_indexes():
+    # the secondary indexes of the searched tables. The FULLTEXT index only exists on MySQL and isn't used here
+    from models import ForSale, House, Rental
+
+    return [index for model in (House, Rental, ForSale) for index in model.__table__.indexes
+            if index.name != 'ix_houses_fulltext']
+
+
+def time_searches(client, repeat):
+    results = {}
+    for name, params in SEARCHES.items():
+        def search():
+            response = client.get('/houses/search', query_string=params)
+            assert response.status_code == 200, response.json
+
+        results[name] = measure(search, repeat)
+    return results
+
+
+def main():
+    parser = arguments('Times /houses/search without and with the search indexes.', repeat=20)
+    parser.add_argument('--rows', type=int, default=1000000, help='number of listings to generate')
+    args = parser.parse_args()
+
+    app = load_app(args.database, SEARCH_CACHE_TTL=0)
+    from models import db
+
+    with app.app_context():
+        print(f'inserting {args.rows} listings...')
+        seed_houses(args.rows, seed_agent())
+        engine = db.engine
+        indexes = search_indexes()
+
+        for index in indexes:
+            index.drop(engine, checkfirst=True)
+        before = time_searches(app.test_client(), args.repeat)
+        for index in indexes:
+            index.create(engine)
+        after = time_searches(app.test_client(), args.repeat)
+
+    print(f'{args.rows} listings, {args.repeat} runs per search')
+    for name in SEARCHES:
+        print(f'{name:<26} without indexes: {summary(before[name])}   with indexes: {summary(after[name])}')
+
+
+if __name__ == '__main__':
+    main()
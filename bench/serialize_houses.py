@@ -0,0 +1,69 @@
+# rows/sec for turning --rows rental listings into the /houses/search 'data' list, with the shared serializers and
+# FastJSONProvider (serializers.py) next to the per-request __dict__ copies and Flask's default JSON provider they
+# replaced. Also times the whole path: loading the rows, serialising and encoding them:
+#     python bench/serialize_houses.py --rows 10000
+import uuid
+
+from flask.json.provider import DefaultJSONProvider
+
+from common import arguments, load_app, measure, percentile, seed_agent, seed_houses
+
+
+def legacy_house_dict(house):
+    # the dict search_houses() used to build for a rental
+    data = house.__dict__.copy()
+    data.pop('_sa_instance_state', None)
+    data.pop('rentals', None)
+    data['house_id'] = str(uuid.UUID(bytes=data['house_id']))
+    data['user_id'] = str(uuid.UUID(bytes=data['user_id']))
+    data['monthly_price'] = house.rentals.monthly_price
+    data['available_start'] = house.rentals.available_start
+    data['available_end'] = house.rentals.available_end
+    return data
+
+
+def main():
+    parser = arguments('Times serialising rental listings into search responses.', repeat=10)
+    parser.add_argument('--rows', type=int, default=10000, help='number of rental listings to serialise')
+    args = parser.parse_args()
+
+    app = load_app(args.database)
+    from models import db
+    from search import build_search_query, house_dict, house_rows
+    from serializers import orjson
+
+    default_json = DefaultJSONProvider(app)
+    with app.app_context():
+        # every other generated listing is a rental
+        seed_houses(args.rows * 2, seed_agent())
+        query = build_search_query('rental')
+        houses = query.all()
+
+        def load():
+            db.session.expunge_all()
+            return build_search_query('rental').all()
+
+        measurements = {
+            'dicts, __dict__ copy (before)': lambda: [legacy_house_dict(house) for house in houses],
+            'dicts, house_dict': lambda: [house_dict(house, 'rental') for house in houses],
+            'dicts + JSON, __dict__ copy + default provider (before)':
+                lambda: default_json.dumps([legacy_house_dict(house) for house in houses]),
+            'dicts + JSON, house_dict + FastJSONProvider':
+                lambda: app.json.dumps([house_dict(house, 'rental') for house in houses]),
+            'load + dicts + JSON, ORM objects + __dict__ copy (before)':
+                lambda: default_json.dumps([legacy_house_dict(house) for house in load()]),
+            'load + dicts + JSON, house_rows + FastJSONProvider':
+                lambda: app.json.dumps(list(house_rows(query, 'rental'))),
+        }
+        # both encodings must give the same document
+        assert default_json.loads(measurements['dicts + JSON, __dict__ copy + default provider (before)']()) == \
+            default_json.loads(measurements['dicts + JSON, house_dict + FastJSONProvider']())
+
+        print(f'{len(houses)} rentals, {args.repeat} runs per measurement, orjson: {"yes" if orjson else "no"}')
+        for name, fn in measurements.items():
+            seconds = percentile(measure(fn, args.repeat), 50) / 1000
+            print(f'{name:<60} {len(houses) / seconds:>10,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+# wsgi:app and asgi:app with BENCH_SQL_LATENCY_MS milliseconds added to every SQL statement sent to SQLite, slept in the
+# thread that runs the statement like a round trip to a remote database: the request's thread for the sync driver,
+# the connection's own thread for aiosqlite. Served by async_vs_sync.py:
+#     gunicorn -c gunicorn.conf.py --pythonpath bench sql_latency:app
+#     uvicorn --app-dir bench sql_latency:asgi_app
+import os
+import sqlite3
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from asgi import app as asgi_app  # noqa: F401
+from wsgi import app  # noqa: F401
+
+LATENCY = float(os.getenv('BENCH_SQL_LATENCY_MS', '0')) / 1000
+
+
+def _wait(statement):
+    time.sleep(LATENCY)
+
+
+@event.listens_for(Engine, 'connect')
+def _add_latency(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.set_trace_callback(_wait)
+    else:
+        # aiosqlite, the callback has to be set from its thread
+        dbapi_connection.run_async(lambda connection: connection.set_trace_callback(_wait))
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+import json
+import threading
+import time
+import uuid
+
+
+class LRUCache:
+    # in-process cache backend. Holds at most max_size entries, evicting the least recently used one, and drops entries
+    # older than ttl seconds. Values are stored as-is
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    # shared cache backend so every worker sees the same entries and invalidations. client is anything with redis-py's
+    # get/mget/setex/delete, which lets tests or local runs pass a stand-in instead of a real server. Values are stored
+    # as JSON, serialised with dumps (the app's JSON provider, so dates come back the way jsonify would render them)
+    def __init__(self, client, ttl=300, prefix='amlah:', dumps=json.dumps):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.dumps = dumps
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis  # optional dependency, only needed when CACHE_BACKEND is 'redis'
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def get_many(self, keys):
+        # all keys in a single round trip (MGET)
+        return [None if raw is None else json.loads(raw)
+                for raw in self.client.mget([self.prefix + key for key in keys])]
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, self.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        # only used by tests, shared entries simply expire
+        pass
+
+
+# backend key holding the current generation token of a ReadThroughCache
+GENERATION_KEY = '__generation__'
+
+
+def _generation_name(key):
+    # backend key holding the generation token of key, or the cache-wide one if key is None
+    return GENERATION_KEY if key is None else f'{GENERATION_KEY}:{key}'
+
+
+class ReadThroughCache:
+    # read-through cache in front of a backend (LRUCache or RedisCache). Keys are strings, loader returns the value to
+    # cache or None if there is nothing to cache (e.g. the row doesn't exist). Keeps hit/miss counters for /cache/stats
+    def __init__(self, name, backend=None, ttl_config='CACHE_TTL'):
+        self.name = name
+        self.backend = backend or LRUCache()
+        self.ttl_config = ttl_config
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        # picks the backend from the app config: CACHE_BACKEND ('memory' or 'redis'), the TTL setting named by
+        # ttl_config, CACHE_MAX_SIZE and CACHE_REDIS_URL
+        ttl = app.config.get(self.ttl_config, 300)
+        if app.config.get('CACHE_BACKEND') == 'redis':
+            self.backend = RedisCache.from_url(app.config['CACHE_REDIS_URL'], ttl=ttl, prefix=f'amlah:{self.name}:',
+                                               dumps=app.json.dumps)
+        else:
+            self.backend = LRUCache(max_size=app.config.get('CACHE_MAX_SIZE', 1024), ttl=ttl)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = loader()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+    def generation(self, key=None):
+        # token to prefix keys with so that bump() invalidates every entry at once. A token (instead of a counter)
+        # keeps this safe when the generation entry itself expires or is evicted: a new token is simply started.
+        # Passing a key gives that key a generation of its own, bumped with bump(key)
+        return self.generations([key])[0]
+
+    def generations(self, keys):
+        # the generation tokens of several keys with a single backend lookup, see generation
+        names = [_generation_name(key) for key in keys]
+        tokens = self.backend.get_many(names)
+        for i, token in enumerate(tokens):
+            if token is None:
+                tokens[i] = uuid.uuid4().hex
+                self.backend.set(names[i], tokens[i])
+        return tokens
+
+    def peek_generation(self, key=None):
+        # the current generation token of key, or None if it expired or was never started (unlike generation(), this
+        # doesn't start a new one)
+        return self.backend.get(_generation_name(key))
+
+    def bump(self, key=None):
+        # starts a new generation of key and returns its token
+        token = uuid.uuid4().hex
+        self.backend.set(_generation_name(key), token)
+        return token
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+# serialised GET /houses payloads keyed by house_id
+house_cache = ReadThroughCache('house')
+
+# house_id lists of /houses/search pages keyed by the normalised filters, see search.search_cache_key
+search_cache = ReadThroughCache('search', ttl_config='SEARCH_CACHE_TTL')
@@ -0,0 +1,331 @@
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only needed when SEARCH_ENGINE is 'columnar'
+    np = None
+
+from sqlalchemy import event
+
+from cache import search_cache
+from models import ForSale, House, Rental, db
+from search import (ATTRIBUTE_FILTERS, PRICE_BUCKET_SIZES, SEARCH_MODELS, SORT_COLUMNS, cursor_value, decode_cursor,
+                    facet_list)
+
+# House columns kept as float arrays, NULL is stored as NaN so that it never matches a comparison (same as in SQL)
+NUMERIC_COLUMNS = ['bedrooms', 'bathrooms', 'square_feet', 'rating', 'num_views']
+# House date columns, kept as float arrays of date.toordinal() (NaN for NULL)
+DATE_COLUMNS = ['create_date']
+# House columns kept as integer codes of their distinct values, NULL is stored as -1
+CODED_COLUMNS = ['property_type', 'city', 'pets', 'garage']
+# every array of the index, in the order of the columns selected by ColumnarIndex._load
+FIELDS = ['house_id'] + NUMERIC_COLUMNS + DATE_COLUMNS + CODED_COLUMNS + ['rental', 'rent', 'for_sale', 'sale']
+# search_cache generation bumped by the commits that change indexed houses, see _queue_house_writes
+WRITE_VERSION_KEY = 'columnar'
+
+
+class ColumnarIndex:
+    # in-process copy of the filterable attributes of every listing in NumPy arrays, sorted by house_id. Answers the
+    # plain filter + house_id/price sorted pages of /houses/search with vectorised masks, so only the page itself has to
+    # be loaded from the database. Houses written by this process are re-read on the next search; any other change of
+    # the write version (bulk writes, writes by other workers when the cache is shared) reloads everything, and so does
+    # an index older than max_age seconds: with the memory cache backend the writes of other workers only show up then
+    def __init__(self):
+        self.enabled = False
+        self.max_age = 300
+        self._columns = None
+        self._codes = {name: {} for name in CODED_COLUMNS}
+        # value of every code, as first read: the codes of casefolded keys (see _key) give back the original spelling
+        self._labels = {name: [] for name in CODED_COLUMNS}
+        self._version = None
+        self._checked = 0.0
+        self._loaded = 0.0
+        self._resets = 0
+        self._pending = set()
+        self._fold = False
+        # _lock guards the attributes above, _update_lock is held by the one search updating the columns
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SEARCH_ENGINE') == 'columnar'
+        self.max_age = app.config.get('COLUMNAR_MAX_AGE', 300)
+        if self.enabled and np is None:
+            raise RuntimeError("SEARCH_ENGINE is 'columnar' but numpy is not installed.")
+
+    def handles(self, sort, q=None, bbox=None):
+        # keyword and map searches, and the relevance/distance sorts that come with them, stay in SQL
+        return self.enabled and not q and not bbox and (sort == 'house_id' or sort in SORT_COLUMNS)
+
+    def _key(self, value):
+        # MySQL compares strings case-insensitively, keep the codes consistent with what its WHERE clause would match
+        return value.casefold() if self._fold and isinstance(value, str) else value
+
+    def _code(self, name, value):
+        if value is None:
+            return -1
+        codes, key = self._codes[name], self._key(value)
+        if key not in codes:
+            self._labels[name].append(value)
+            codes[key] = len(codes)
+        return codes[key]
+
+    def _load(self, house_ids=None):
+        # rows of FIELDS for every house, or only for house_ids. Always read from the primary: the index is kept until the
+        # next write, so rows missed by a lagging replica would stay missing
+        query = db.session.query(
+            House.house_id, *[getattr(House, name) for name in NUMERIC_COLUMNS + DATE_COLUMNS + CODED_COLUMNS],
+            Rental.house_id, Rental.monthly_price, ForSale.house_id, ForSale.price) \
+            .outerjoin(Rental, Rental.house_id == House.house_id) \
+            .outerjoin(ForSale, ForSale.house_id == House.house_id)
+        if house_ids is not None:
+            query = query.filter(House.house_id.in_(house_ids))
+        with db.session().on_primary():
+            return query.all()
+
+    def _arrays(self, rows):
+        values = dict(zip(FIELDS, zip(*rows))) if rows else {name: () for name in FIELDS}
+        columns = {'house_id': np.array(values['house_id'], dtype=object)}
+        for name in NUMERIC_COLUMNS + ['rent', 'sale']:
+            columns[name] = np.array([np.nan if value is None else value for value in values[name]], dtype=float)
+        for name in DATE_COLUMNS:
+            columns[name] = np.array([np.nan if value is None else value.toordinal() for value in values[name]],
+                                     dtype=float)
+        for name in CODED_COLUMNS:
+            columns[name] = np.array([self._code(name, value) for value in values[name]], dtype=np.int32)
+        for name in ('rental', 'for_sale'):
+            columns[name] = np.array([value is not None for value in values[name]], dtype=bool)
+        return columns
+
+    def _sorted(self, columns):
+        order = np.argsort(columns['house_id'], kind='stable')
+        return {name: array[order] for name, array in columns.items()}
+
+    def _merge(self, columns, house_ids):
+        # re-reads house_ids and swaps their rows into a copy of columns (deleted houses simply aren't read back). The
+        # ids are looked up as objects: as a bytes array (np.isin's conversion) they'd lose their trailing NUL bytes
+        ids = np.array(list(house_ids), dtype=object)
+        positions = np.searchsorted(columns['house_id'], ids)
+        found = positions < len(columns['house_id'])
+        found[found] = columns['house_id'][positions[found]] == ids[found]
+        keep = np.ones(len(columns['house_id']), dtype=bool)
+        keep[positions[found]] = False
+        fresh = self._arrays(self._load(house_ids))
+        return self._sorted({name: np.concatenate([array[keep], fresh[name]]) for name, array in columns.items()})
+
+    def _due(self, version, now):
+        # the update the columns need before answering a search that read the write version at now: 'reload', 'merge'
+        # (re-read the pending houses) or None. The write version expires SEARCH_CACHE_TTL after the last write. Its
+        # absence only proves that nobody wrote since the previous search if that search was less than a TTL ago,
+        # otherwise the write may have expired too
+        if self._columns is None or now - self._loaded >= self.max_age:
+            return 'reload'
+        if version is None:
+            changed = now - self._checked >= search_cache.backend.ttl
+        else:
+            changed = version != self._version
+        if changed:
+            return 'reload'
+        return 'merge' if self._pending else None
+
+    def _sync(self):
+        # returns the up to date columns. Searches only ever read a complete set of arrays, updates build a new one
+        # outside _lock and swap it in
+        version = search_cache.peek_generation(WRITE_VERSION_KEY)
+        now = time.monotonic()
+        with self._lock:
+            due = self._due(version, now)
+            columns = self._columns
+            if due is None:
+                self._version = version
+                self._checked = now
+                return columns
+
+        # one search at a time updates the columns. The others keep answering from the current ones during a reload,
+        # only the first load and the re-reads of written houses (a search may follow a write of its own) are waited for
+        if not self._update_lock.acquire(blocking=columns is None or due == 'merge'):
+            return columns
+        try:
+            with self._lock:
+                # the search holding _update_lock before this one may have done the update already
+                due = self._due(version, now)
+                columns, pending, version_seen, resets = self._columns, self._pending, self._version, self._resets
+                self._pending = set()
+            if due == 'reload':
+                self._fold = db.session.get_bind().dialect.name == 'mysql'
+                columns = self._sorted(self._arrays(self._load()))
+            elif due == 'merge':
+                columns = self._merge(columns, pending)
+            with self._lock:
+                # a bulk write (reset) during the update has to be followed by a reload, these columns are not kept
+                if self._resets == resets:
+                    self._columns = columns
+                    if due == 'reload':
+                        self._loaded = now
+                    # unless a write of this process has taken over a newer version meanwhile, see queue
+                    if self._version == version_seen:
+                        self._version = version
+                    self._checked = now
+            return columns
+        finally:
+            self._update_lock.release()
+
+    def queue(self, house_ids, version):
+        # called once the writes to house_ids are committed. They started the write version given, which is taken over
+        # here: only the listed houses are re-read by the next search
+        with self._lock:
+            if self._columns is not None:
+                self._pending |= house_ids
+                self._version = version
+
+    def reset(self):
+        with self._lock:
+            self._columns = None
+            self._resets += 1
+
+    def _equals(self, columns, name, value):
+        code = self._codes[name].get(self._key(value))
+        if code is None:
+            return np.zeros(len(columns['house_id']), dtype=bool)
+        return columns[name] == code
+
+    def _mask(self, columns, house_type, property_type, city, price_min, price_max, filters):
+        # returns (rows matching the filters of build_search_query, price column of house_type)
+        rental = house_type == 'rental'
+        price = columns['rent' if rental else 'sale']
+
+        mask = columns['rental' if rental else 'for_sale'].copy()
+        if price_min is not None:
+            mask &= price >= price_min
+        if price_max is not None:
+            mask &= price <= price_max
+        if property_type:
+            mask &= self._equals(columns, 'property_type', property_type)
+        if city:
+            mask &= self._equals(columns, 'city', city)
+        for param, value in (filters or {}).items():
+            name, op = ATTRIBUTE_FILTERS[param]
+            if op == '>=':
+                mask &= columns[name] >= value
+            elif op == '<=':
+                mask &= columns[name] <= value
+            else:
+                mask &= self._equals(columns, name, value)
+        return mask, price
+
+    def search(self, house_type, property_type=None, city=None, price_min=None, price_max=None, filters=None,
+               sort='house_id', cursor=None, page_size=50):
+        # same matches and order as build_search_query + order_and_seek. Returns (house_ids of the page, whether more
+        # matches follow). Raises ValueError for an invalid cursor
+        columns = self._sync()
+        house_ids = columns['house_id']
+        mask, price = self._mask(columns, house_type, property_type, city, price_min, price_max, filters)
+
+        # rows are sorted by house_id, so "after the cursor's house" is every row from its insertion point on (before it
+        # for descending sorts)
+        if sort in SORT_COLUMNS:
+            name, descending = SORT_COLUMNS[sort]
+            keys = price if name == 'price' else columns[name]
+            # houses without a value come after the others, ordered by house_id in the direction of the sort
+            nulls = np.isnan(keys)
+            if cursor is not None:
+                value, house_id = decode_cursor(cursor)
+                value = cursor_value(name, value)
+                positions = np.arange(len(house_ids))
+                if descending:
+                    after_id = positions < np.searchsorted(house_ids, house_id, side='left')
+                else:
+                    after_id = positions >= np.searchsorted(house_ids, house_id, side='right')
+                if value is None:
+                    mask &= nulls & after_id
+                else:
+                    if name in DATE_COLUMNS:
+                        value = value.toordinal()
+                    after_value = keys < value if descending else keys > value
+                    mask &= nulls | after_value | ((keys == value) & after_id)
+            rows = np.flatnonzero(mask & ~nulls)
+            null_rows = np.flatnonzero(mask & nulls)
+            if descending:
+                rows = rows[::-1]
+                rows = _top(rows, -keys[rows], page_size + 1)
+                null_rows = null_rows[::-1]
+            else:
+                rows = _top(rows, keys[rows], page_size + 1)
+            rows = np.concatenate([rows, null_rows[:page_size + 1 - len(rows)]])
+        else:
+            if cursor is not None:
+                _, house_id = decode_cursor(cursor)
+                mask[:np.searchsorted(house_ids, house_id, side='right')] = False
+            rows = np.flatnonzero(mask)
+
+        return [house_ids[row] for row in rows[:page_size]], len(rows) > page_size
+
+    def facet_counts(self, house_type, property_type=None, city=None, price_min=None, price_max=None, filters=None,
+                     facets=()):
+        # same counts as search.facet_counts, taken from the matching rows of the arrays
+        columns = self._sync()
+        mask, price = self._mask(columns, house_type, property_type, city, price_min, price_max, filters)
+        counts = {}
+        for facet in facets:
+            if facet == 'property_type':
+                labels = self._labels[facet]
+                values, found = np.unique(columns[facet][mask], return_counts=True)
+                counts[facet] = {None if code < 0 else labels[code]: int(count) for code, count in zip(values, found)}
+                continue
+            if facet == 'price':
+                size = PRICE_BUCKET_SIZES[house_type]
+                values = price[mask] - price[mask] % size
+            else:
+                values = columns[facet][mask]
+            values, found = np.unique(values, return_counts=True)
+            # np.unique groups every NaN (NULL) into a single, last value
+            counts[facet] = {None if np.isnan(value) else int(value): int(count) for value, count in zip(values, found)}
+        return {facet: facet_list(values) for facet, values in counts.items()}
+
+
+def _top(rows, keys, count):
+    # the first count rows ordered by keys, rows with equal keys staying in their given order. Only the rows up to the
+    # count-th smallest key are sorted, the rest is dropped by a linear time partition
+    if len(rows) > count:
+        kth = np.partition(keys, count - 1)[count - 1]
+        keep = keys <= kth
+        rows, keys = rows[keep], keys[keep]
+    return rows[np.argsort(keys, kind='stable')[:count]]
+
+
+columnar_index = ColumnarIndex()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_house_writes(session, flush_context):
+    if columnar_index.enabled:
+        session.info.setdefault('columnar_house_ids', set()).update(
+            obj.house_id for obj in (*session.new, *session.dirty, *session.deleted) if isinstance(obj, SEARCH_MODELS))
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _flag_bulk_house_write(orm_execute_state):
+    # the rows touched by bulk UPDATE/DELETE statements aren't known, the index is rebuilt instead
+    if columnar_index.enabled and (orm_execute_state.is_update or orm_execute_state.is_delete) \
+            and orm_execute_state.bind_mapper is not None and orm_execute_state.bind_mapper.class_ in SEARCH_MODELS:
+        orm_execute_state.session.info['columnar_reload'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _queue_house_writes(session):
+    house_ids = session.info.pop('columnar_house_ids', None)
+    reload = session.info.pop('columnar_reload', False)
+    if reload or house_ids:
+        # the new write version makes the other workers sharing search_cache reload their index
+        version = search_cache.bump(WRITE_VERSION_KEY)
+        if reload:
+            columnar_index.reset()
+        else:
+            columnar_index.queue(house_ids, version)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _clear_house_writes(session):
+    session.info.pop('columnar_house_ids', None)
+    session.info.pop('columnar_reload', None)
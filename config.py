@@ -4,3 +4,45 @@ from dotenv import load_dotenv
 load_dotenv()
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
+    # read replicas of the primary as a comma separated list of URIs. GET requests read from one of them, writes and
+    # reads after a write stay on the primary (see replicas.py)
+    SQLALCHEMY_BINDS = {f"replica_{i}": uri.strip()
+                        for i, uri in enumerate(os.getenv("SQLALCHEMY_REPLICA_URIS", "").split(",")) if uri.strip()}
+    # connection pool of each worker process. pool_size should cover the threads of a worker (see gunicorn.conf.py),
+    # overflow connections absorb bursts. pre_ping replaces connections the server dropped and recycle retires them
+    # before MySQL's wait_timeout (or a proxy) does
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    }
+    # pool of the asyncio engine used by asgi.py (see async_routes.py). A process there keeps a query in flight per
+    # concurrent request rather than per thread, so it gets a larger pool
+    SQLALCHEMY_ASYNC_ENGINE_OPTIONS = dict(SQLALCHEMY_ENGINE_OPTIONS,
+                                           pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", "50")))
+
+    # cache for house detail payloads. CACHE_BACKEND is either 'memory' (per process) or 'redis' (shared between
+    # workers, needs the redis package and CACHE_REDIS_URL)
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+    CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+    CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+    CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "1024"))
+    # search result pages are only cached briefly, they are also dropped whenever a listing changes
+    SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "30"))
+    # availability templates are dropped by every worker on a change with the redis backend, with the memory backend
+    # other workers keep using theirs for up to this many seconds
+    AVAILABILITY_CACHE_TTL = int(os.getenv("AVAILABILITY_CACHE_TTL", "60"))
+    # 'columnar' answers the filter-only /houses/search pages from in-memory NumPy arrays (needs numpy), 'sql' doesn't
+    SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "sql")
+    # seconds after which the columnar index is reloaded in full. With CACHE_BACKEND=redis a worker sees the listing
+    # writes of the other workers on its next search, with 'memory' only once its index is this old
+    COLUMNAR_MAX_AGE = int(os.getenv("COLUMNAR_MAX_AGE", "300"))
+    # per request query figures, see query_stats.py. They are returned as X-DB-* response headers in debug mode or with
+    # QUERY_STATS_HEADERS. Statements slower than SLOW_QUERY_MS, and requests spending SLOW_REQUEST_DB_MS in the
+    # database or issuing SLOW_REQUEST_QUERIES statements, are logged as warnings (0 turns a threshold off)
+    QUERY_STATS_HEADERS = os.getenv("QUERY_STATS_HEADERS", "false").lower() == "true"
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+    SLOW_REQUEST_DB_MS = float(os.getenv("SLOW_REQUEST_DB_MS", "500"))
+    SLOW_REQUEST_QUERIES = int(os.getenv("SLOW_REQUEST_QUERIES", "50"))
@@ -0,0 +1,29 @@
+import multiprocessing
+import os
+
+# gunicorn settings for wsgi:app, every value can be overridden from the environment
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# requests are mostly waiting on MySQL, so each worker also serves a few of them concurrently on threads. Keep
+# DB_POOL_SIZE at least as large as this
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "4"))
+timeout = int(os.getenv("WEB_TIMEOUT", "30"))
+keepalive = 5
+# recycles workers now and then so a slow leak can't grow forever, the jitter keeps them from restarting together
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "5000"))
+max_requests_jitter = 500
+# the app is imported once in the master and forked, which makes starting and replacing workers cheap
+preload_app = True
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    # connections opened by the master while loading the app must not be shared between processes: every worker drops
+    # them (without closing the master's sockets) and opens its own pool on first use
+    from wsgi import app
+    from models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,17 @@
+-- Bounded city/property_type columns and the /houses/search indexes declared in models.py.
+-- db.create_all() only creates missing tables, so databases created before these changes need this script:
+--     mysql -u <user> -p amlahbackend < migrations/001_search_indexes.sql
+-- Values longer than the new limits must be shortened first, check with:
+--     SELECT house_id FROM houses WHERE CHAR_LENGTH(city) > 100 OR CHAR_LENGTH(property_type) > 50;
+
+ALTER TABLE houses
+    MODIFY city VARCHAR(100) NOT NULL,
+    MODIFY property_type VARCHAR(50) NULL;
+
+CREATE INDEX ix_houses_city_property_type ON houses (city, property_type);
+CREATE INDEX ix_rentals_monthly_price ON rentals (monthly_price, house_id);
+CREATE INDEX ix_for_sale_price ON for_sale (price, house_id);
+
+-- appointment index from models.py (booking overlap check and availability lookups). Fails if the table already holds
+-- two appointments for the same house, date and start time, remove those first
+CREATE UNIQUE INDEX ix_appointments_house_date_start ON appointments (house_id, date, start_time);
@@ -0,0 +1,4 @@
+-- FULLTEXT index behind the keyword search ('q') of /houses/search, see ix_houses_fulltext in models.py.
+--     mysql -u <user> -p amlahbackend < migrations/002_fulltext_search.sql
+
+CREATE FULLTEXT INDEX ix_houses_fulltext ON houses (name, description, amenities, interior_features);
@@ -0,0 +1,10 @@
+-- coordinates and grid cell index behind the map search ('bbox', 'lat'/'lng'/'radius_km') of /houses/search, see
+-- House.geo_cell in models.py. Existing houses stay out of map results until their coordinates are set.
+--     mysql -u <user> -p amlahbackend < migrations/003_geo_search.sql
+
+ALTER TABLE houses
+    ADD COLUMN latitude DOUBLE NULL,
+    ADD COLUMN longitude DOUBLE NULL,
+    ADD COLUMN geo_cell INT NULL;
+
+CREATE INDEX ix_houses_geo_cell ON houses (geo_cell);
@@ -0,0 +1,6 @@
+-- indexes behind the create_date/rating/num_views sorts of /houses/search, see House.__table_args__ in models.py.
+--     mysql -u <user> -p amlahbackend < migrations/004_sort_indexes.sql
+
+CREATE INDEX ix_houses_create_date ON houses (create_date, house_id);
+CREATE INDEX ix_houses_rating ON houses (rating, house_id);
+CREATE INDEX ix_houses_num_views ON houses (num_views, house_id);
@@ -0,0 +1,24 @@
+-- blocks taken by the existing appointments, see AppointmentSlot in models.py. Booking only checks appointment_slots,
+-- so it has to be filled before the new code is deployed. Appointments are 15 minutes long and take one block, or two
+-- when they don't start on a block boundary. Overlapping appointments booked before this change make the INSERTs fail
+-- and have to be removed first. Appointments of deleted houses (house_id cleared, see House.appointments) take no block.
+--     mysql -u <user> -p amlahbackend < migrations/005_appointment_slots.sql
+
+CREATE TABLE IF NOT EXISTS appointment_slots (
+    house_id BINARY(16) NOT NULL,
+    date DATE NOT NULL,
+    slot SMALLINT NOT NULL,
+    appt_id BINARY(16) NOT NULL,
+    PRIMARY KEY (house_id, date, slot),
+    KEY ix_appointment_slots_appt_id (appt_id),
+    FOREIGN KEY (house_id) REFERENCES houses (house_id),
+    FOREIGN KEY (appt_id) REFERENCES appointments (appt_id)
+);
+
+INSERT INTO appointment_slots (house_id, date, slot, appt_id)
+SELECT house_id, date, FLOOR(TIME_TO_SEC(start_time) / 900), appt_id FROM appointments
+WHERE house_id IS NOT NULL;
+
+INSERT INTO appointment_slots (house_id, date, slot, appt_id)
+SELECT house_id, date, FLOOR(TIME_TO_SEC(start_time) / 900) + 1, appt_id FROM appointments
+WHERE TIME_TO_SEC(start_time) % 900 != 0 AND house_id IS NOT NULL;
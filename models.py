@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -48,6 +50,19 @@ class Agent(db.Model):
 
 class House(db.Model):
     __tablename__ = 'houses'
+    __table_args__ = (
+        # serves the city/property_type filters of /houses/search (city alone or city + property_type)
+        db.Index('ix_houses_city_property_type', 'city', 'property_type'),
+        # keyword search ('q') of /houses/search, MySQL only
+        db.Index('ix_houses_fulltext', 'name', 'description', 'amenities', 'interior_features',
+                 mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+        # map viewport/radius search of /houses/search, see search.geo_cell
+        db.Index('ix_houses_geo_cell', 'geo_cell'),
+        # sort=create_date|rating|num_views of /houses/search, read backwards for the newest/highest first
+        db.Index('ix_houses_create_date', 'create_date', 'house_id'),
+        db.Index('ix_houses_rating', 'rating', 'house_id'),
+        db.Index('ix_houses_num_views', 'num_views', 'house_id'),
+    )
 
     house_id = db.Column(db.BINARY(16), primary_key=True)
     street = db.Column(db.Text, nullable=False)
@@ -56,7 +71,7 @@ class House(db.Model):
     unit_num = db.Column(db.Text)
     country = db.Column(db.Text, nullable=False)
     state = db.Column(db.Text)
-    city = db.Column(db.Text, nullable=False)
+    city = db.Column(db.String(100), nullable=False)  # bounded so MySQL can index it
     user_id = db.Column(db.BINARY(16), db.ForeignKey('agent.user_id'))
     appliances = db.Column(db.Text)
     bathrooms = db.Column(db.Integer)
@@ -88,7 +103,7 @@ class House(db.Model):
     owner_phone = db.Column(db.Text)
     parking_spots = db.Column(db.Integer)
     pet_policy = db.Column(db.Text)
-    property_type = db.Column(db.Text)
+    property_type = db.Column(db.String(50))  # bounded so MySQL can index it
     publish_status = db.Column(db.Text)
     rating = db.Column(db.SmallInteger)
     terms_conditions = db.Column(db.Text)
@@ -97,6 +112,9 @@ class House(db.Model):
     modified_date = db.Column(db.Date)
     pets = db.Column(db.Text)
     target_move_date = db.Column(db.Date)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geo_cell = db.Column(db.Integer)  # grid cell of (latitude, longitude), set with search.geo_cell
 
     rentals = db.relationship('Rental', backref='house', uselist=False)
     for_sale = db.relationship('ForSale', backref='house', uselist=False)
@@ -117,6 +135,11 @@ class ListingAvailability(db.Model):
 
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        # serves the booking overlap check and the per-house availability lookups. Unique so that two concurrent
+        # bookings of the same start time can never both be committed, AppointmentSlot covers overlapping start times
+        db.Index('ix_appointments_house_date_start', 'house_id', 'date', 'start_time', unique=True),
+    )
 
     appt_id = db.Column(db.BINARY(16), primary_key=True)
     house_id = db.Column(db.BINARY(16), db.ForeignKey('houses.house_id'))
@@ -128,6 +151,19 @@ class Appointment(db.Model):
     description = db.Column(db.Text)
 
 
+class AppointmentSlot(db.Model):
+    # the 15 minute blocks (counted from midnight) taken by an appointment, one row per block it touches. The primary
+    # key makes two overlapping appointments of a house impossible to commit at the same time, whatever their start
+    # times, also on databases that ignore the FOR UPDATE lock of the booking (e.g. SQLite). Removed together with the
+    # appointment
+    __tablename__ = 'appointment_slots'
+
+    house_id = db.Column(db.BINARY(16), db.ForeignKey('houses.house_id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    slot = db.Column(db.SmallInteger, primary_key=True)
+    appt_id = db.Column(db.BINARY(16), db.ForeignKey('appointments.appt_id'), nullable=False, index=True)
+
+
 class Saved(db.Model):
     __tablename__ = 'saved'
 
@@ -148,6 +184,10 @@ class Client(db.Model):
 
 class ForSale(db.Model):
     __tablename__ = 'for_sale'
+    __table_args__ = (
+        # price range filter of /houses/search, house_id makes it covering for the join back to houses
+        db.Index('ix_for_sale_price', 'price', 'house_id'),
+    )
 
     house_id = db.Column(db.BINARY(16), db.ForeignKey('houses.house_id'), primary_key=True)
     price = db.Column(db.Integer)
@@ -155,6 +195,10 @@ class ForSale(db.Model):
 
 class Rental(db.Model):
     __tablename__ = 'rentals'
+    __table_args__ = (
+        # price range filter of /houses/search, house_id makes it covering for the join back to houses
+        db.Index('ix_rentals_monthly_price', 'monthly_price', 'house_id'),
+    )
 
     house_id = db.Column(db.BINARY(16), db.ForeignKey('houses.house_id'), primary_key=True)
     available_start = db.Column(db.Date)
@@ -0,0 +1,128 @@
+import heapq
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# number of statements reported in the X-DB-Slowest headers and the slow request log
+SLOWEST_COUNT = 3
+# statements are shortened to this many characters in headers and log lines
+MAX_STATEMENT_LENGTH = 300
+# rowcount pymysql reports for unbuffered (streamed) results, whose number of rows isn't known upfront
+UNKNOWN_ROWCOUNT = 2 ** 64 - 1
+
+
+def _short(statement):
+    return ' '.join(statement.split())[:MAX_STATEMENT_LENGTH]
+
+
+class RequestQueries:
+    # statements executed while handling a single request: their number, total time in seconds, rows returned or
+    # affected (as reported by the driver's rowcount: pymysql and aiomysql count the rows of a SELECT, sqlite3 doesn't)
+    # and the SLOWEST_COUNT slowest of them
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self._slowest = []
+
+    def add(self, statement, seconds, rows):
+        self.count += 1
+        self.seconds += seconds
+        if rows is not None:
+            self.rows += rows
+        # min-heap of (seconds, n, statement, rows), the fastest of the kept statements is replaced
+        entry = (seconds, self.count, statement, rows)
+        if len(self._slowest) < SLOWEST_COUNT:
+            heapq.heappush(self._slowest, entry)
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        # [(milliseconds, statement, rows)], slowest first
+        return [(seconds * 1000, _short(statement), rows)
+                for seconds, _, statement, rows in sorted(self._slowest, reverse=True)]
+
+
+class QueryStats:
+    # per request query instrumentation, fed by the cursor events of every engine (including the asyncio engines of
+    # async_routes.py). In debug mode (or with QUERY_STATS_HEADERS) the figures are returned as response headers;
+    # otherwise statements slower than SLOW_QUERY_MS and requests over SLOW_REQUEST_DB_MS of database time or with at
+    # least SLOW_REQUEST_QUERIES statements are logged as warnings. A threshold of 0 turns that check off
+    def __init__(self):
+        self.headers = False
+        self.slow_query_ms = 0
+        self.slow_request_ms = 0
+        self.slow_request_queries = 0
+
+    def init_app(self, app):
+        self.headers = app.config.get('QUERY_STATS_HEADERS', False)
+        self.slow_query_ms = app.config.get('SLOW_QUERY_MS', 0)
+        self.slow_request_ms = app.config.get('SLOW_REQUEST_DB_MS', 0)
+        self.slow_request_queries = app.config.get('SLOW_REQUEST_QUERIES', 0)
+        app.after_request(self._add_headers)
+        app.teardown_request(self._log_request)
+
+    def record(self, statement, seconds, rows):
+        if not has_request_context():
+            return
+        queries = g.get('queries')
+        if queries is None:
+            queries = g.queries = RequestQueries()
+        queries.add(statement, seconds, rows)
+
+        if self.slow_query_ms and seconds * 1000 >= self.slow_query_ms:
+            current_app.logger.warning('slow query %.1f ms (%s rows) in %s %s: %s', seconds * 1000,
+                                       '?' if rows is None else rows, request.method, request.path, _short(statement))
+
+    def _add_headers(self, response):
+        # the statements of a streamed body run after the headers are sent and aren't included
+        if not (self.headers or current_app.debug):
+            return response
+        queries = g.get('queries') or RequestQueries()
+        response.headers['X-DB-Query-Count'] = str(queries.count)
+        response.headers['X-DB-Time-Ms'] = f'{queries.seconds * 1000:.1f}'
+        response.headers['X-DB-Rows'] = str(queries.rows)
+        for ms, statement, rows in queries.slowest():
+            response.headers.add('X-DB-Slowest', f"{ms:.1f}ms rows={'?' if rows is None else rows} {statement}")
+        response.headers.add('Server-Timing', f'db;dur={queries.seconds * 1000:.1f};desc="{queries.count} queries"')
+        return response
+
+    def _log_request(self, exc):
+        queries = g.pop('queries', None)
+        if queries is None:
+            return
+        ms = queries.seconds * 1000
+        if (self.slow_request_ms and ms >= self.slow_request_ms) or \
+                (self.slow_request_queries and queries.count >= self.slow_request_queries):
+            slowest = '; '.join(f"{ms:.1f} ms ({'?' if rows is None else rows} rows) {statement}"
+                                for ms, statement, rows in queries.slowest())
+            current_app.logger.warning('slow request %s %s (%s): %d queries, %.1f ms in the database, %d rows. '
+                                       'Slowest: %s', request.method, request.path, request.endpoint, queries.count,
+                                       ms, queries.rows, slowest)
+
+
+query_stats = QueryStats()
+
+
+# registered on the Engine class, so every engine (every bind, and the sync side of the asyncio engines) is covered.
+# A connection runs one statement at a time, the start time is kept on it
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+    rows = cursor.rowcount
+    query_stats.record(statement, seconds, rows if 0 <= rows < UNKNOWN_ROWCOUNT else None)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _fail_query(exception_context):
+    # a failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
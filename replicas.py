@@ -0,0 +1,43 @@
+from contextlib import contextmanager
+import random
+
+from flask import request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+# prefix of the SQLALCHEMY_BINDS keys that are read replicas of the primary database (see Config)
+REPLICA_PREFIX = 'replica_'
+
+
+class RoutingSession(Session):
+    # db.session class that sends the reads of GET requests to the read replica picked for the request (info['replica'],
+    # set by init_app). Writes go to the primary, and so does everything after the first write of a request, so that a
+    # request always reads its own writes. Inside on_primary() reads go to the primary too
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info['replica'] = None
+            elif not self.info.get('primary'):
+                return self._db.engines[replica]
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    @contextmanager
+    def on_primary(self):
+        # for reads that must see the latest writes, e.g. loads that fill a cache shared by every request
+        self.info['primary'] = self.info.get('primary', 0) + 1
+        try:
+            yield self
+        finally:
+            self.info['primary'] -= 1
+
+
+def init_app(app, db):
+    # picks a replica for every GET request. Without replicas configured everything stays on the primary
+    replicas = [key for key in app.config.get('SQLALCHEMY_BINDS') or {} if key.startswith(REPLICA_PREFIX)]
+
+    @app.before_request
+    def _route_reads():
+        # set on every request, the session may outlive a request when an app context is already pushed (e.g. tests)
+        db.session().info['replica'] = random.choice(replicas) if replicas and request.method in ('GET', 'HEAD') \
+            else None
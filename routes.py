@@ -1,13 +1,31 @@
 from datetime import datetime, timedelta
+from itertools import chain, islice
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from sqlalchemy.exc import IntegrityError
 
 from models import *
+from cache import house_cache, search_cache
+from availability import cancel_outside_window, house_slot_grid, house_slot_grids, on_grid, release_slots, \
+    slot_claims, slots_taken, template_cache
+from columnar import columnar_index
+from search import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SORT_KEYS, build_search_query, facet_counts, fetch_by_ids,
+                    first_rows, geo_cell, house_detail, house_detail_query, house_dict, house_rows, house_view,
+                    nearest_page, next_page_cursor, order_and_seek, parse_attribute_filters, parse_facets, parse_fields,
+                    parse_geo, search_cache_key)
+from serializers import agent_serializer, saved_serializer, user_serializer
 import uuid
 
 bp = Blueprint('app', __name__)
 
+# upper bounds on the number of houses and days accepted by /houses/availability/batch
+MAX_BATCH_HOUSES = 100
+MAX_BATCH_DAYS = 90
+# upper bound on the number of items accepted by /houses/appointment/bulk
+MAX_BULK_APPOINTMENTS = 200
+# answer to a booking whose start_time isn't on the 15 minute grid, see availability.on_grid
+OFF_GRID_MESSAGE = 'Appointments start on the hour or at :15, :30 or :45.'
+
 """
 Formats: ALL DATES (YYYY-MM-DD). ALL TIMES (HH:MM:SS)
 
@@ -16,10 +34,17 @@ Appointments (/houses/appointment):
            Pass in 'house_id' to retrieve appointments associated with the given house. Returns all info
            about all appointments.
     - POST: Create an appointment through passed JSON object. Must specify 'user_id', 'house_id', 'date', and 
-            'start_time'. Can also optionally pass 'name' and 'description'. 'end_time' will automatically
-            be set to 15 minutes after 'start_time'. Will allow creation of appointments outside of available
+            'start_time', which must be on the hour or at :15, :30 or :45. Can also optionally pass 'name' and
+            'description'. 'end_time' will automatically be set to 15 minutes after 'start_time'. Will allow creation of appointments outside of available
             hours (i.e. assumes well formed requests)
     - DELETE: Takes in a single query parameter, 'appt_id'. Deletes the appointment associated with the appt_id.
+
+Bulk appointments (/houses/appointment/bulk):
+    - POST: Takes in a JSON object with an 'appointments' list (at most 200), each item having the same fields as POST
+            /houses/appointment. Valid, non-overlapping items are created in a single transaction. 'data' holds a
+            result per item ('success', 'message' and 'appt_id' when created) in request order.
+    - DELETE: Takes in a JSON object with an 'appt_ids' list (at most 200). Deletes all listed appointments in a single
+              transaction. 'data' holds a result per item in request order.
     
 Availability (/houses/availability):
     - GET: Takes in 3 query parameters: 'house_id', 'date', 'days'. Returns the availability for the given
@@ -35,6 +60,12 @@ Availability (/houses/availability):
               Upon deletion, will delete any appointments that do not fit in the recurring availability for that day of the week.
               Does not support deletion of recurring availabilities. To "delete" recurring availabilities, set start time and
               end time to the same value. Returns a list of all user_id's of user's whose appointments were canceled. 
+
+Availability batch (/houses/availability/batch):
+    - GET: Takes in 'house_ids' (comma separated, at most 100), 'date' and 'days' (at most 90) as query parameters.
+           Returns the same availability as GET /houses/availability for every house, keyed by house_id. Pass
+           'first_free=true' to only return the earliest free block ({'date', 'time'}) of each house. Unknown houses
+           map to null.
               
 Saved (/users/saved):
     - GET: Takes in 1 query parameter: 'user_id'. Fetches all saved houses for that user.
@@ -44,16 +75,19 @@ Saved (/users/saved):
               user's saved collection.
               
 Houses (/houses)
-    - GET: Takes in 1 query parameter: 'house_id'. Retrieves all information about the specified house.
+    - GET: Takes in 1 query parameter: 'house_id'. Retrieves all information about the specified house. Optionally takes
+           'fields', a comma separated list of columns to return (e.g. 'name,city,bedrooms'). house_id and the price
+           fields are always returned. Pass 'include_agent=true' to embed a summary of the listing agent as 'agent'.
     - POST: Takes in a JSON object. Required fields are 'type' (either "rental" or "for_sale"), 'street', 'city', 'user_id',
             'zipcode', 'country', 'description', 'HOA', and 'name'. Will create a new house with the specified attributes.
+            Pass 'latitude' and 'longitude' to make the house findable by the map search of /houses/search.
             Returns the house_id of the newly created house.
 
 Agents (/users/agents)
-    - GET: Retrieves all agents
+    - GET: Retrieves all agents. Paginated like /houses/search: 'limit' (default 50, max 500) and 'cursor'/'next_cursor'.
 
 Clients (/users/clients)
-    - GET: Retrieves all clients
+    - GET: Retrieves all clients. Paginated like /users/agents.
     
 Users (/users) 
     - GET: Takes in 1 query parameter: 'user_id'. Retrieves all information about that user.
@@ -61,15 +95,34 @@ Users (/users)
             specified information.
     - DELETE: Takes in 1 query parameter: 'user_id'. Deletes from the database the user associated with that user_id.
     
+Cache stats (/cache/stats)
+    - GET: Returns the hit/miss counters and hit rate of the house detail, search and availability template caches.
+
 Search (/houses/search)
     - GET: Takes in 5 query parameters: 'type', 'property_type', 'city', 'price_min', and 'price_max'. 'type' is  
            required and must be either 'rental' or 'for_sale'. Returns JSON of all houses matching the criteria specified.
+           Results are paginated: 'limit' sets the page size (default 50, max 500) and 'next_cursor' is returned
+           while more results exist; pass it back as 'cursor' to get the next page. 'sort' is 'house_id'
+           (default), 'price' (cheapest first), '-price' (most expensive first), 'create_date' (newest first), 'rating'
+           or 'num_views' (highest first) or 'relevance'; houses without a value for the sort key come last.
+           Pass 'format=ndjson' to instead stream every match as one JSON object per line.
+           'fields' limits the returned columns, same as GET /houses. 'q' searches keywords in the name, description,
+           amenities and interior features; matches are then sorted by relevance unless another 'sort' is given.
+           Map search: 'bbox' (min_lat,min_lng,max_lat,max_lng) only returns houses inside the viewport, or 'lat',
+           'lng' and 'radius_km' those within radius_km of the point, sorted by distance. 'sort=distance' (the default
+           for a radius search) adds 'distance_km' to every house; with a bbox it is measured from 'lat'/'lng' if given,
+           else from the center of the box. Distance sorted results can't be streamed.
+           Attribute filters: 'bedrooms_min', 'bathrooms_min', 'square_feet_min', 'square_feet_max', 'pets' (exact
+           match) and 'garage' (true/false).
+           'facets' (comma separated: 'property_type', 'bedrooms', 'price') adds 'facets' to the response: for each
+           facet, the number of houses matching all filters per value, e.g. {'bedrooms': [{'value': 2, 'count': 14}]}.
+           Prices are counted in buckets of 500 (rentals) or 50000 (for sale) labelled by their lower bound. A radius
+           search only counts the houses within radius_km. Can't be combined with 'format=ndjson'.
 """
 
 # TO DO: What to do when someone wants to delete/change availability of a house that has appointments scheduled?
 # TO DO: On a similar note, we need to think about what interactions change with appointment and availability. For example, when a listing is removed, we should get rid of all appointments and all listings. Same when deleting a user.
 # TO DO: Switch over data model to prevent deletion. Add a field for "status" which lets us know about active, sold, rented properties.
-# TO DO: Pagination for search routes
 
 # currently allows for appointments to be made on times that aren't available for the listing
 @bp.route('/houses/appointment', methods=['GET', 'POST', 'DELETE'])
@@ -142,7 +195,7 @@ def house_appointment():
         try:
             user_id = uuid.UUID(data['user_id']).bytes
             house_id = uuid.UUID(data['house_id']).bytes
-            appointment_date = datetime.fromisoformat(data['date'])  # Ensure date is valid
+            appointment_date = datetime.fromisoformat(data['date']).date()  # Ensure date is valid
             start_time = datetime.strptime(data['start_time'], "%H:%M:%S")  # Format to match input
             name = data.get('name')
             description = data.get('description')
@@ -160,16 +213,34 @@ def house_appointment():
                 'message': 'Name too long.',
             }), 400
 
-        overlaps = Appointment.query.filter(Appointment.start_time < end_time, start_time < Appointment.end_time).first()
+        if not on_grid(start_time.time()):
+            return jsonify({
+                'success': False,
+                'message': OFF_GRID_MESSAGE,
+            }), 400
 
-        if overlaps:
+        # lock the house row (SELECT ... FOR UPDATE) until the appointment is committed so that concurrent bookings for
+        # the same house run the overlap check one after another. Bookings for other houses are not blocked
+        house = House.query.with_entities(House.house_id).filter_by(house_id=house_id).with_for_update().first()
+        if not house:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'message': 'House not found.',
+            }), 404
+
+        # overlapping appointments share a block (see AppointmentSlot). The blocks are claimed in the same transaction
+        appointment_id = uuid.uuid4().bytes
+        claims = slot_claims(appointment_id, house_id, appointment_date, start_time.time(), end_time.time())
+
+        if slots_taken(claims):
+            db.session.rollback()
             return jsonify({
                 'success': False,
                 'message': 'Overlaps with existing appointment.',
             }), 403
 
         # create a new appointment instance
-        appointment_id = uuid.uuid4().bytes
         new_appointment = Appointment(
             appt_id=appointment_id,
             user_id=user_id,
@@ -184,7 +255,23 @@ def house_appointment():
         # attempt to add new appointment
         try:
             db.session.add(new_appointment)
+            db.session.flush()
+            db.session.execute(db.insert(AppointmentSlot), claims)
             db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            # another request may have claimed one of the blocks first (see AppointmentSlot). This is the fallback for
+            # databases that ignore FOR UPDATE, e.g. SQLite
+            if slots_taken(claims):
+                return jsonify({
+                    'success': False,
+                    'message': 'Overlaps with existing appointment.',
+                }), 403
+            return jsonify({
+                'success': False,
+                'message': 'Failed to create appointment.',
+                'data': str(e)
+            }), 500
         except Exception as e:
             db.session.rollback()
             return jsonify({
@@ -214,6 +301,7 @@ def house_appointment():
                     'data': None
                 }), 404
 
+            release_slots([appt_id])
             db.session.delete(appointment)
             db.session.commit()
 
@@ -229,6 +317,163 @@ def house_appointment():
             }), 400
 
 
+# creates or cancels many appointments at once (e.g. an agent scheduling a whole open-house day). Overlaps are checked
+# against one pre-fetched set of blocks taken by existing appointments, inserts/deletes are done with a single statement and the whole
+# batch is committed once. Returns a result per item in the same order as the request
+@bp.route('/houses/appointment/bulk', methods=['POST', 'DELETE'])
+def house_appointment_bulk():
+    data = request.get_json()
+
+    if request.method == 'POST':
+        items = data.get('appointments') if isinstance(data, dict) else None
+    else:
+        items = data.get('appt_ids') if isinstance(data, dict) else None
+
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            'success': False,
+            'message': "Missing required fields: appointments" if request.method == 'POST' else "Missing required fields: appt_ids",
+            'data': None
+        }), 400
+
+    if len(items) > MAX_BULK_APPOINTMENTS:
+        return jsonify({
+            'success': False,
+            'message': f'At most {MAX_BULK_APPOINTMENTS} appointments can be sent at once.',
+            'data': None
+        }), 400
+
+    results = [None] * len(items)
+
+    if request.method == 'POST':
+        # validate every item first, same rules as POST /houses/appointment
+        parsed = {}
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or not all(key in item for key in ['user_id', 'house_id', 'date', 'start_time']):
+                results[i] = {'success': False, 'message': 'Missing required fields.'}
+                continue
+            try:
+                start_time = datetime.strptime(item['start_time'], "%H:%M:%S")
+                parsed[i] = {
+                    'user_id': uuid.UUID(item['user_id']).bytes,
+                    'house_id': uuid.UUID(item['house_id']).bytes,
+                    'date': datetime.fromisoformat(item['date']).date(),
+                    'start_time': start_time.time(),
+                    'end_time': (start_time + timedelta(minutes=15)).time(),
+                    'name': item.get('name'),
+                    'description': item.get('description')
+                }
+            except (ValueError, TypeError, AttributeError):
+                results[i] = {'success': False, 'message': 'Invalid input format.'}
+                continue
+            # name and description are stored as text, anything else would fail the whole batch on insert
+            if any(parsed[i][key] is not None and not isinstance(parsed[i][key], str) for key in ['name', 'description']):
+                del parsed[i]
+                results[i] = {'success': False, 'message': 'Invalid input format.'}
+                continue
+            if parsed[i]['name'] and len(parsed[i]['name']) >= 255:
+                del parsed[i]
+                results[i] = {'success': False, 'message': 'Name too long.'}
+            elif not on_grid(parsed[i]['start_time']):
+                del parsed[i]
+                results[i] = {'success': False, 'message': OFF_GRID_MESSAGE}
+
+        house_ids = {appt['house_id'] for appt in parsed.values()}
+        dates = {appt['date'] for appt in parsed.values()}
+
+        # lock every house in the batch (see POST /houses/appointment) and fetch the blocks taken on the requested days
+        existing_houses = {house_id for (house_id,) in House.query.with_entities(House.house_id)
+                           .filter(House.house_id.in_(house_ids)).with_for_update().all()}
+        taken = set(AppointmentSlot.query.with_entities(
+            AppointmentSlot.house_id, AppointmentSlot.date, AppointmentSlot.slot)
+            .filter(AppointmentSlot.house_id.in_(existing_houses), AppointmentSlot.date.in_(dates)).all())
+
+        new_appointments = []
+        new_claims = []
+        for i, appt in parsed.items():
+            if appt['house_id'] not in existing_houses:
+                results[i] = {'success': False, 'message': 'House not found.'}
+                continue
+            # overlapping appointments share a block. checks against existing appointments as well as the ones
+            # accepted earlier in this batch
+            appt['appt_id'] = uuid.uuid4().bytes
+            claims = slot_claims(appt['appt_id'], appt['house_id'], appt['date'], appt['start_time'], appt['end_time'])
+            blocks = {(claim['house_id'], claim['date'], claim['slot']) for claim in claims}
+            if blocks & taken:
+                results[i] = {'success': False, 'message': 'Overlaps with existing appointment.'}
+                continue
+            taken |= blocks
+            new_appointments.append(appt)
+            new_claims += claims
+            results[i] = {'success': True, 'message': 'Appointment created successfully!',
+                          'appt_id': str(uuid.UUID(bytes=appt['appt_id']))}
+
+        if new_appointments:
+            try:
+                db.session.execute(db.insert(Appointment), new_appointments)
+                db.session.execute(db.insert(AppointmentSlot), new_claims)
+                db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                # a concurrent request booked one of the blocks first (see AppointmentSlot), nothing was created
+                return jsonify({
+                    'success': False,
+                    'message': 'Overlaps with an appointment booked at the same time, no appointments were created.',
+                    'data': str(e)
+                }), 403
+            except Exception as e:
+                db.session.rollback()
+                return jsonify({
+                    'success': False,
+                    'message': 'Failed to create appointments.',
+                    'data': str(e)
+                }), 500
+        else:
+            db.session.rollback()
+
+        return jsonify({
+            'success': True,
+            'message': f'Created {len(new_appointments)} of {len(items)} appointments.',
+            'data': results
+        }), 201 if new_appointments else 200
+
+    elif request.method == 'DELETE':
+        appt_ids = {}
+        for i, appt_id_str in enumerate(items):
+            try:
+                appt_ids[i] = uuid.UUID(appt_id_str).bytes
+            except (ValueError, TypeError, AttributeError):
+                results[i] = {'success': False, 'message': 'Invalid input format.'}
+
+        found = {appt_id for (appt_id,) in Appointment.query.with_entities(Appointment.appt_id)
+                 .filter(Appointment.appt_id.in_(appt_ids.values())).all()}
+
+        for i, appt_id in appt_ids.items():
+            if appt_id in found:
+                results[i] = {'success': True, 'message': 'Appointment deleted successfully!'}
+            else:
+                results[i] = {'success': False, 'message': 'Appointment not found.'}
+
+        try:
+            if found:
+                release_slots(found)
+                Appointment.query.filter(Appointment.appt_id.in_(found)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'message': 'Failed to delete appointments.',
+                'data': str(e)
+            }), 500
+
+        return jsonify({
+            'success': True,
+            'message': f'Deleted {len(found)} of {len(items)} appointments.',
+            'data': results
+        }), 200
+
+
 
 # gets the availability for the next 'days' days. User can specify the number of days to retrieve
 @bp.route('/houses/availability', methods=['GET', 'POST', 'DELETE'])
@@ -285,41 +530,7 @@ def house_availability():
             }), 404
 
 
-        end_date = start_date + timedelta(days=num_days)
-
-        availability_results = {}
-
-        availability = ListingAvailability.query.filter_by(house_id=house_id)
-        appointments = Appointment.query.filter_by(house_id=house_id).filter(Appointment.date >= start_date, Appointment.date < end_date)
-
-        for x in range((end_date - start_date).days):
-            # calculate the date using the start date and the number of
-            cur_date = start_date + timedelta(days=x)
-            apts_today = appointments.filter_by(date=cur_date).all()
-            apts = []
-            for apt in apts_today:
-                apts.append(datetime.combine(cur_date, apt.start_time))
-            time_blocks = []
-            non_recurring = availability.filter_by(available_date=cur_date).first()
-            if not non_recurring:
-
-                # if the entry is recurring, calculate the day offset and then use that to find the target_date
-                # we call datetime.weekday() here: "Return the day of the week as an integer, where Monday is 0 and Sunday is 6."
-                av = availability.filter_by(day_of_the_week=cur_date.weekday()).first()
-
-                start_time = datetime.combine(cur_date, av.start_time)
-                end_time = datetime.combine(cur_date, av.end_time)
-                while start_time < end_time:
-                    time_blocks.append(start_time.strftime("%H:%M Booked" if start_time in apts else "%H:%M Free"))
-                    start_time += timedelta(minutes=15)
-                availability_results[cur_date.isoformat()] = time_blocks
-            else:
-                start_time = datetime.combine(cur_date, non_recurring.start_time)
-                end_time = datetime.combine(cur_date, non_recurring.end_time)
-                while start_time < end_time:
-                    time_blocks.append(start_time.strftime("%H:%M Booked" if start_time in apts else "%H:%M Free"))
-                    start_time += timedelta(minutes=15)
-                availability_results[cur_date.isoformat()] = time_blocks
+        availability_results = house_slot_grid(house_id, start_date, num_days)
 
         # Return the ordered JSON response
         return jsonify({
@@ -370,13 +581,11 @@ def house_availability():
                 # Update existing availability
                 availability.start_time = start_time
                 availability.end_time = end_time
-                deleted_appointment_users = []
-                canceled_appointments = Appointment.query.filter_by(house_id=house_id).filter((Appointment.start_time < start_time) |
-                                                                                          (Appointment.end_time > end_time)).all()
-                for appt in canceled_appointments:
-                    deleted_appointment_users.append(str(uuid.UUID(bytes=appt.user_id)))
-                    # db.session.delete(appt)
+                # only dates on this weekday are affected. Appointments are reported but not deleted
+                deleted_appointment_users = cancel_outside_window(house_id, start_time, end_time,
+                                                                  weekday=day_of_the_week, delete=False)
                 db.session.commit()
+                template_cache.invalidate(house_id)
                 return jsonify({
                     'success': True,
                     'message': 'Recurring availability updated successfully.',
@@ -395,6 +604,7 @@ def house_availability():
                 )
                 db.session.add(new_availability)
                 db.session.commit()
+                template_cache.invalidate(house_id)
                 return jsonify({
                     'success': True,
                     'message': 'Recurring availability added successfully.',
@@ -411,22 +621,28 @@ def house_availability():
                     'message': "Missing required fields: available_date_str"
                 }), 400
 
+            try:
+                available_date = datetime.fromisoformat(available_date_str).date()
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'message': 'Invalid date format. Use YYYY-MM-DD.',
+                    'data': None
+                }), 400
+
             # Check for existing non-recurring availability
             availability = ListingAvailability.query.filter_by(house_id=house_id,
-                                                               available_date=available_date_str,
+                                                               available_date=available_date,
                                                                is_recurring=False).first()
-            deleted_appointment_users = []
-            canceled_appointments = Appointment.query.filter_by(house_id=house_id).filter((Appointment.start_time < start_time) |
-                                                                                          (Appointment.end_time > end_time)).all()
-            for appt in canceled_appointments:
-                deleted_appointment_users.append(str(uuid.UUID(bytes=appt.user_id)))
-                db.session.delete(appt)
+            # only appointments on available_date are affected
+            deleted_appointment_users = cancel_outside_window(house_id, start_time, end_time, on_date=available_date)
 
             if availability:
                 # Update existing non-recurring availability
                 availability.start_time = start_time
                 availability.end_time = end_time
                 db.session.commit()
+                template_cache.invalidate(house_id)
                 return jsonify({
                     'success': True,
                     'message': 'Non-recurring availability updated successfully.',
@@ -438,13 +654,14 @@ def house_availability():
                 new_availability = ListingAvailability(
                     pattern_id=pattern_id,
                     house_id=house_id,
-                    available_date=available_date_str,
+                    available_date=available_date,
                     start_time=start_time,
                     end_time=end_time,
                     is_recurring=False
                 )
                 db.session.add(new_availability)
                 db.session.commit()
+                template_cache.invalidate(house_id)
                 return jsonify({
                     'success': True,
                     'message': 'Non-recurring availability added successfully.',
@@ -483,19 +700,19 @@ def house_availability():
                 'data': None
             }), 404
         recurring_availability = ListingAvailability.query.filter_by(house_id=house_id, day_of_the_week=dotw).first()
-        start_time = recurring_availability.start_time
-        end_time = recurring_availability.end_time
+        if recurring_availability:
+            start_time = recurring_availability.start_time
+            end_time = recurring_availability.end_time
+        else:
+            # no recurring availability for that day, so every appointment on that date is canceled
+            start_time = end_time = listing.start_time
 
         try:
             db.session.delete(listing)
-            deleted_appointment_users = []
-            canceled_appointments = Appointment.query.filter_by(house_id=house_id).filter((Appointment.start_time < start_time) |
-                                                                                          (Appointment.end_time > end_time)).all()
-            for appt in canceled_appointments:
-                print(appt.start_time)
-                deleted_appointment_users.append(str(uuid.UUID(bytes=appt.user_id)))
-                db.session.delete(appt)
+            # only appointments on the deleted date are affected
+            deleted_appointment_users = cancel_outside_window(house_id, start_time, end_time, on_date=date)
             db.session.commit()
+            template_cache.invalidate(house_id)
         except Exception as e:
             db.session.rollback()
             return jsonify({
@@ -511,6 +728,79 @@ def house_availability():
 
 
 
+# gets the availability of many houses at once (e.g. a search results page). Same as GET /houses/availability but takes a
+# comma separated list of house_ids and answers with a fixed number of queries no matter how many houses are requested
+@bp.route('/houses/availability/batch', methods=['GET'])
+def house_availability_batch():
+    house_ids_str = request.args.get('house_ids')
+    date_str = request.args.get('date')
+    num_days = request.args.get('days')
+    first_free = request.args.get('first_free', '').lower() in ('1', 'true', 'yes')
+
+    if not date_str or not num_days or not house_ids_str:
+        return jsonify({
+            'success': False,
+            'message': "Missing required fields"
+        }), 400
+
+    try:
+        num_days = int(num_days)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': "num_days should be an integer."
+        }), 400
+
+    if num_days <= 0:
+        return jsonify({
+            'success': False,
+            'message': 'Please specify a positive number of days.'
+        }), 400
+
+    if num_days > MAX_BATCH_DAYS:
+        return jsonify({
+            'success': False,
+            'message': f'At most {MAX_BATCH_DAYS} days can be requested at once.'
+        }), 400
+
+    house_id_strs = [house_id_str.strip() for house_id_str in house_ids_str.split(',') if house_id_str.strip()]
+    if len(house_id_strs) > MAX_BATCH_HOUSES:
+        return jsonify({
+            'success': False,
+            'message': f'At most {MAX_BATCH_HOUSES} house_ids can be requested at once.'
+        }), 400
+
+    # Validate house_id format
+    try:
+        house_ids = {str(uuid.UUID(house_id_str)): uuid.UUID(house_id_str).bytes for house_id_str in house_id_strs}
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid house_id format.',
+            'data': None
+        }), 400
+
+    try:
+        start_date = datetime.fromisoformat(date_str).date()
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid date format. Use YYYY-MM-DD.',
+            'data': None
+        }), 400
+
+    # houses that don't exist are returned with a value of None
+    existing = {house_id for (house_id,) in
+                House.query.with_entities(House.house_id).filter(House.house_id.in_(house_ids.values())).all()}
+    results = house_slot_grids(list(existing), start_date, num_days, first_free=first_free)
+
+    return jsonify({
+        'success': True,
+        'data': {house_id_str: results.get(house_id) for house_id_str, house_id in house_ids.items()}
+    }), 200
+
+
+
 
 
 @bp.route('/users/saved', methods=['GET', 'POST', 'DELETE'])
@@ -525,16 +815,7 @@ def saved_houses():
                 'message': 'Invalid user_id format.',
                 'data': None}), 400
         saved = Saved.query.filter_by(user_id=user_id).all()
-        saved_data = []
-        for house in saved:
-            saved_data.append({
-                'house_id': str(uuid.UUID(bytes=house.house_id)),
-                'name': house.name,
-                'date_created': house.date_created,
-                'date_modified': house.date_modified,
-                'notes': house.notes,
-                'tag': house.tag
-            })
+        saved_data = [saved_serializer(house) for house in saved]
         return jsonify({
             'success': True,
             'message': "Returned houses",
@@ -655,34 +936,32 @@ def house_by_id():
                 'message': 'Invalid house_id format.',
                 'data': None}), 400
 
-        house = House.query.filter_by(house_id=house_id).first()
+        fields = request.args.get('fields')
+        if fields:
+            try:
+                parse_fields(fields)
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'message': str(e),
+                    'data': None}), 400
 
-        if not house:
+        # the full payload is cached per house, 'fields' and 'include_agent' are applied to the cached copy. It is loaded
+        # from the primary so that a replica lagging behind a write can't put an outdated copy in the cache
+        with db.session().on_primary():
+            data = house_cache.get_or_load(str(uuid.UUID(bytes=house_id)),
+                                           lambda: house_detail(house_detail_query(house_id).first()))
+
+        if not data:
             return jsonify({
                 'success': False,
                 'message': 'House not found.',
                 'data': None}), 404
 
-        house_dict = house.__dict__.copy()
-        house_dict.pop('_sa_instance_state', None)  # Remove SQLAlchemy-specific state
-        house_dict['house_id'] = house_id_str
-        house_dict['user_id'] = str(uuid.UUID(bytes=house_dict['user_id']))
-
-        rental = Rental.query.filter_by(house_id=house_id).first()
-        for_sale = ForSale.query.filter_by(house_id=house_id).first()
-
-        if rental:
-            house_dict['monthly_price'] = rental.monthly_price
-            house_dict['available_start'] = rental.available_start
-            house_dict['available_end'] = rental.available_end
-
-        if for_sale:
-            house_dict['price'] = for_sale.price
-
         return jsonify({
             'success': True,
             'message': 'House data found',
-            'data': house_dict
+            'data': house_view(data, fields, request.args.get('include_agent', '').lower() in ('1', 'true', 'yes'))
         }), 200
 
     # must send a JSON Object when POSTing. Must include additional field "type" which is either "rentals" or "for_sale".
@@ -719,6 +998,26 @@ def house_by_id():
                 'message': 'Invalid user_id. User does not exist.',
                 'data': None}), 400
 
+        # Optional coordinates, used by the map search of /houses/search
+        latitude = data.get('latitude')
+        longitude = data.get('longitude')
+        if (latitude is None) != (longitude is None) or (latitude is not None and (
+                not isinstance(latitude, (int, float)) or not isinstance(longitude, (int, float))
+                or not -90 <= latitude <= 90 or not -180 <= longitude <= 180)):
+            return jsonify({
+                'success': False,
+                'message': 'latitude and longitude must be given together as valid coordinates.',
+                'data': None}), 400
+
+        # city and property_type are bounded so that they can be indexed (see House), longer values can't be stored
+        for key in ['city', 'property_type']:
+            max_length = getattr(House, key).type.length
+            if isinstance(data.get(key), str) and len(data[key]) > max_length:
+                return jsonify({
+                    'success': False,
+                    'message': f'{key} must be at most {max_length} characters.',
+                    'data': None}), 400
+
         # Create a new House instance
         new_house = House(
             house_id=house_id,
@@ -768,7 +1067,10 @@ def house_by_id():
             create_date=data.get('create_date'),  # Handle date format
             modified_date=data.get('modified_date'),  # Handle date format
             pets=data.get('pets'),
-            target_move_date=data.get('target_move_date')  # Handle date format
+            target_move_date=data.get('target_move_date'),  # Handle date format
+            latitude=latitude,
+            longitude=longitude,
+            geo_cell=geo_cell(latitude, longitude)
         )
 
         # Add house to the appropriate table based on the type
@@ -790,6 +1092,7 @@ def house_by_id():
 
         db.session.add(new_house)
         db.session.commit()
+        house_cache.invalidate(str(uuid.UUID(bytes=house_id)))
 
         return jsonify({
             'success': True,
@@ -825,10 +1128,14 @@ def house_by_id():
         # Remove the corresponding entries in the rentals or for_sale table
         Rental.query.filter_by(house_id=house_id).delete(synchronize_session=False)
         ForSale.query.filter_by(house_id=house_id).delete(synchronize_session=False)
+        # the appointments are kept (their house_id is cleared) but the blocks they took refer to the house
+        release_slots(db.select(Appointment.appt_id).where(Appointment.house_id == house_id))
 
         # Finally, delete the house itself
         db.session.delete(house)
         db.session.commit()
+        template_cache.invalidate(house_id)
+        house_cache.invalidate(str(uuid.UUID(bytes=house_id)))
 
         return jsonify({
             'success': True,
@@ -836,81 +1143,63 @@ def house_by_id():
             'data': None}), 200
 
 
-# retrieves all agents
+def _page_by_user_id(model):
+    # returns (rows, next_cursor) for one page of model (Agent or Client) ordered by user_id, with the user row loaded
+    # by the same JOIN. Reads 'limit' and 'cursor' (the next_cursor of the previous page) from the request and raises
+    # ValueError if either is invalid
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor')
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}.')
+
+    query = model.query.join(model.user).options(db.contains_eager(model.user))
+    if cursor:
+        try:
+            query = query.filter(model.user_id > uuid.UUID(cursor).bytes)
+        except ValueError:
+            raise ValueError('Invalid cursor.')
+
+    # fetch one extra row to know whether there is a next page
+    rows = query.order_by(model.user_id).limit(limit + 1).all()
+    next_cursor = str(uuid.UUID(bytes=rows[limit - 1].user_id)) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# retrieves all agents, one page at a time
 @bp.route('/users/agents', methods=['GET'])
 def get_agents():
-    agents = Agent.query.all()
-    agent_data = []
-    for agent in agents:
-        user_id = agent.user_id
-        user = User.query.filter_by(user_id=user_id).first()
-        agent_data.append({
-            'user_id': str(uuid.UUID(bytes=user_id)),
-            'email': user.email,
-            'about_me': user.about_me,
-            'address': user.address,
-            'birthday': user.birthday,
-            'country': user.country,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'gender': user.gender,
-            'language': user.language,
-            'logout_event': user.logout_event,
-            'logout_date': user.logout_date,
-            'phone': user.phone,
-            'profile_picture': user.profile_picture,
-            'rating': user.rating,
-            'search_price_min': user.search_price_min,
-            'search_price_max': user.search_price_max,
-            'search_city': user.search_city,
-            'property_type': user.property_type,
-            'search_status': user.search_status,
-            'search_text': user.search_text,
-            'company_name': agent.company_name,
-            'num_customers': agent.num_customers,
-            'num_properties': agent.num_properties,
-            'properties_rented': agent.properties_rented,
-            "properties_sold": agent.properties_sold
-        })
+    try:
+        agents, next_cursor = _page_by_user_id(Agent)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+    # every user column plus the agent's own columns
+    agent_data = [{**user_serializer(agent.user), **agent_serializer(agent)} for agent in agents]
     return jsonify({
         'success': True,
-        'data': agent_data
+        'data': agent_data,
+        'next_cursor': next_cursor
     }), 200
 
-# retrieves all clients
+# retrieves all clients, one page at a time
 @bp.route('/users/clients', methods=['GET'])
 def get_clients():
-    clients = Client.query.all()
-    client_data = []
-    for client in clients:
-        user_id = client.user_id
-        user = User.query.filter_by(user_id=user_id).first()
-        client_data.append({
-            'user_id': str(uuid.UUID(bytes=user_id)),
-            'email': user.email,
-            'about_me': user.about_me,
-            'address': user.address,
-            'birthday': user.birthday,
-            'country': user.country,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'gender': user.gender,
-            'language': user.language,
-            'logout_event': user.logout_event,
-            'logout_date': user.logout_date,
-            'phone': user.phone,
-            'profile_picture': user.profile_picture,
-            'rating': user.rating,
-            'search_price_min': user.search_price_min,
-            'search_price_max': user.search_price_max,
-            'search_city': user.search_city,
-            'property_type': user.property_type,
-            'search_status': user.search_status,
-            'search_text': user.search_text
-        })
+    try:
+        clients, next_cursor = _page_by_user_id(Client)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+    client_data = [user_serializer(client.user) for client in clients]
     return jsonify({
         'success': True,
-        'data': client_data
+        'data': client_data,
+        'next_cursor': next_cursor
     }), 200
 
 
@@ -944,42 +1233,12 @@ def user_by_id():
                 'message': 'User not found.',
                 'data': None}), 404
 
-        user_data = {
-            'user_id': str(uuid.UUID(bytes=user.user_id)),
-            'email': user.email,
-            'about_me': user.about_me,
-            'address': user.address,
-            'birthday': user.birthday,
-            'country': user.country,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'gender': user.gender,
-            'language': user.language,
-            'logout_event': user.logout_event,
-            'logout_date': user.logout_date,
-            'phone': user.phone,
-            'profile_picture': user.profile_picture,
-            'rating': user.rating,
-            'search_price_min': user.search_price_min,
-            'search_price_max': user.search_price_max,
-            'search_city': user.search_city,
-            'property_type': user.property_type,
-            'search_status': user.search_status,
-            'search_text': user.search_text
-        }
-
+        user_data = user_serializer(user)
 
         # Check in the agents table
         agent = Agent.query.filter_by(user_id=user.user_id).first()
         if agent:
-            agent_data = {
-                'user_id': str(uuid.UUID(bytes=agent.user_id)),
-                'company_name': agent.company_name,
-                'num_customers': agent.num_customers,
-                'num_properties': agent.num_properties,
-                'properties_rented': agent.properties_rented,
-                'properties_sold': agent.properties_sold,
-            }
+            agent_data = agent_serializer(agent)
             return jsonify({
                 'success': True,
                 'message': 'Agent data found',
@@ -1125,9 +1384,13 @@ def user_by_id():
             }), 404
 
         # Remove related entries in the agent or client table if exists
-        # Delete from the agent table if the user is an agent
+        # Delete from the agent table if the user is an agent. Its houses are kept without an agent, their cached
+        # GET /houses payloads include the agent (see search.house_detail) and are dropped after the commit
         agent = Agent.query.filter_by(user_id=user_id).first()
+        agent_house_ids = []
         if agent:
+            agent_house_ids = [house_id for (house_id,) in
+                               House.query.with_entities(House.house_id).filter_by(user_id=user_id).all()]
             db.session.delete(agent)
 
         # Delete from the client table if the user is a client
@@ -1138,6 +1401,8 @@ def user_by_id():
         # Finally, delete the user itself
         db.session.delete(user)
         db.session.commit()
+        for house_id in agent_house_ids:
+            house_cache.invalidate(str(uuid.UUID(bytes=house_id)))
 
         return jsonify({
             'success': True,
@@ -1146,7 +1411,7 @@ def user_by_id():
         }), 200
 
 
-# look into search APIs to use here for more complicated search queries
+# searches houses by type, filters and keywords (see 'Search' at the top of this file)
 @bp.route('/houses/search', methods=['GET'])
 def search_houses():
     # Get query parameters from the request
@@ -1155,6 +1420,13 @@ def search_houses():
     city = request.args.get('city')  # City filter
     price_min = request.args.get('price_min', type=int)  # Minimum price
     price_max = request.args.get('price_max', type=int)  # Maximum price
+    q = (request.args.get('q') or '').strip()  # Keywords searched in the name, description, amenities and features
+    sort = request.args.get('sort') or ('relevance' if q else 'house_id')  # Order of the results, also the cursor's key
+    cursor = request.args.get('cursor')  # next_cursor of the previous page
+    limit = request.args.get('limit', type=int)  # Page size
+    stream = request.args.get('format') == 'ndjson'  # Stream one house per line instead of returning a page
+    fields = request.args.get('fields')  # Comma separated House columns to return, defaults to all
+    facets = request.args.get('facets')  # Comma separated facets to count the matches of
 
     # Validate house_type input
     if house_type not in ['rental', 'for_sale']:
@@ -1162,66 +1434,172 @@ def search_houses():
             'success': False,
             'message': "Invalid house type. Choose either 'rental' or 'for_sale'."}), 400
 
-    query = House.query
+    # Map viewport ('bbox') or radius ('lat', 'lng', 'radius_km') and attribute filters (bedrooms_min, garage, ...)
+    try:
+        bbox, center, radius_km = parse_geo(request.args)
+        filters = parse_attribute_filters(request.args)
+        facet_names = parse_facets(facets) if facets else []
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)}), 400
+    if radius_km is not None and not request.args.get('sort'):
+        sort = 'distance'
 
-    # Apply filters based on the type of house
-    if house_type == 'rental':
-        query = query.join(Rental)
-        if price_min is not None:
-            query = query.filter(Rental.monthly_price >= price_min)
-        if price_max is not None:
-            query = query.filter(Rental.monthly_price <= price_max)
+    if sort not in SORT_KEYS:
+        return jsonify({
+            'success': False,
+            'message': f"Invalid sort. Choose one of {', '.join(SORT_KEYS)}."}), 400
 
-    elif house_type == 'for_sale':
-        query = query.join(ForSale)
-        if price_min is not None:
-            query = query.filter(ForSale.price >= price_min)
-        if price_max is not None:
-            query = query.filter(ForSale.price <= price_max)
+    if sort == 'relevance' and not q:
+        return jsonify({
+            'success': False,
+            'message': "sort=relevance requires a keyword query 'q'."}), 400
 
-    if property_type:
-        query = query.filter(House.property_type == property_type)
+    if sort == 'distance' and bbox is None:
+        return jsonify({
+            'success': False,
+            'message': "sort=distance requires 'bbox' or 'lat', 'lng' and 'radius_km'."}), 400
 
-    if city:
-        query = query.filter(House.city == city)
+    if radius_km is not None and sort != 'distance':
+        return jsonify({
+            'success': False,
+            'message': 'A radius search is always sorted by distance.'}), 400
 
-    houses = query.all()
+    if sort == 'distance' and stream:
+        return jsonify({
+            'success': False,
+            'message': 'Distance sorted results cannot be streamed.'}), 400
 
-    # Check if houses are found
-    if not houses:
-        temp = jsonify({
-            'success': True,
-            'message': 'No houses found matching the criteria.',
-            'data': []}), 200
-        print(temp)
-        return temp
+    if facet_names and stream:
+        return jsonify({
+            'success': False,
+            'message': 'facets cannot be combined with format=ndjson.'}), 400
 
-    # Transform each house object into a dictionary and return the attributes
-    house_data_list = []
-    for house in houses:
-        house_dict = house.__dict__.copy()
-        house_dict.pop('_sa_instance_state', None)  # Remove SQLAlchemy-specific state
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        return jsonify({
+            'success': False,
+            'message': f'limit must be between 1 and {MAX_PAGE_SIZE}.'}), 400
 
-        # Convert house_id to a string
-        house_dict['house_id'] = str(uuid.UUID(bytes=house_dict['house_id']))
-        house_dict['user_id'] = str(uuid.UUID(bytes=house_dict['user_id']))
+    try:
+        query = build_search_query(house_type, property_type, city, price_min, price_max, fields, q, bbox, filters,
+                                   eager=sort != 'distance')
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)}), 400
+
+    # counts for the whole filter set, cached like the pages
+    facet_data = None
+    if facet_names:
+        def load_facets():
+            if columnar_index.handles('house_id', q, bbox):
+                return columnar_index.facet_counts(house_type, property_type, city, price_min, price_max, filters,
+                                                   facet_names)
+            return facet_counts(build_search_query(house_type, property_type, city, price_min, price_max, q=q,
+                                                   bbox=bbox, filters=filters, eager=False), house_type, facet_names,
+                                center, radius_km)
+
+        facet_key = search_cache_key(house_type, property_type, city, price_min, price_max, None, None, None, q, bbox,
+                                     filters)
+        # a radius search and a bbox search of the square around its circle have the same key, but not the same counts
+        circle = f'{center[0]},{center[1]},{radius_km}' if radius_km is not None else ''
+        facet_data = search_cache.get_or_load(f"facets:{','.join(facet_names)}:{circle}:{facet_key}", load_facets)
+
+    page_size = limit or DEFAULT_PAGE_SIZE
+    if sort == 'distance':
+        # distances depend on the exact point, so these pages aren't cached
+        try:
+            houses, distances, next_cursor = nearest_page(query, house_type, center, radius_km, cursor, page_size,
+                                                          fields)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid cursor.'}), 400
 
-        # If the house is for rent, include rental attributes directly
-        if house_type == 'rental':
-            house_dict['monthly_price'] = house.rentals.monthly_price
-            house_dict['available_start'] = house.rentals.available_start
-            house_dict['available_end'] = house.rentals.available_end
+        data = []
+        for house in houses:
+            house_data = house_dict(house, house_type)
+            house_data['distance_km'] = round(distances[house.house_id], 3)
+            data.append(house_data)
+        return jsonify({
+            'success': True,
+            'message': "Found houses matching the criteria" if data else 'No houses found matching the criteria.',
+            'data': data,
+            'next_cursor': next_cursor,
+            'facets': facet_data
+        }), 200
 
-        if house_type == 'for_sale':
-            house_dict['price'] = house.for_sale.price
+    try:
+        queries = order_and_seek(query, house_type, sort, cursor, q)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid cursor.'}), 400
+
+    if stream:
+        # rows are fetched STREAM_BATCH_SIZE at a time and written out as they arrive, so memory doesn't grow with the
+        # number of matches. Only limited if 'limit' is given
+        if limit is not None:
+            queries = [query.limit(limit) for query in queries]
+
+        def generate():
+            houses = chain.from_iterable(house_rows(query, house_type, fields) for query in queries)
+            for house in islice(houses, limit):
+                yield current_app.json.dumps(house) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    # pages are cached as house_id lists. A cached page only costs one IN (...) query to load its houses
+    cache_key = search_cache_key(house_type, property_type, city, price_min, price_max, sort, cursor, page_size, q,
+                                 bbox, filters)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        houses = fetch_by_ids(house_type, [bytes.fromhex(house_id) for house_id in cached['ids']], fields)
+        next_cursor = cached['next_cursor']
+    else:
+        if columnar_index.handles(sort, q, bbox):
+            # the matches are found in the in-memory columns, only the page itself is read from the database
+            house_ids, more = columnar_index.search(house_type, property_type, city, price_min, price_max, filters,
+                                                    sort, cursor, page_size)
+            houses = fetch_by_ids(house_type, house_ids, fields)
+            next_cursor = next_page_cursor(sort, houses[-1], house_type, cursor, page_size) \
+                if more and houses else None
+        else:
+            # fetch one extra row to know whether there is a next page
+            houses = first_rows(queries, page_size + 1)
+            next_cursor = next_page_cursor(sort, houses[page_size - 1], house_type, cursor, page_size) \
+                if len(houses) > page_size else None
+            houses = houses[:page_size]
+        search_cache.set(cache_key, {'ids': [house.house_id.hex() for house in houses], 'next_cursor': next_cursor})
 
-        house_data_list.append(house_dict)
+    # Check if houses are found
+    if not houses:
+        return jsonify({
+            'success': True,
+            'message': 'No houses found matching the criteria.',
+            'data': [],
+            'next_cursor': None,
+            'facets': facet_data}), 200
 
-    # Return the list of houses
-    temp = jsonify({
+    # Return the page of houses
+    return jsonify({
         'success': True,
         'message': "Found houses matching the criteria",
-        'data': house_data_list
+        'data': [house_dict(house, house_type) for house in houses],
+        'next_cursor': next_cursor,
+        'facets': facet_data
+    }), 200
+
+
+# hit/miss counters of the in-process caches
+@bp.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'success': True,
+        'data': {
+            'house': house_cache.stats(),
+            'search': search_cache.stats(),
+            'availability_templates': template_cache.stats()
+        }
     }), 200
-    print(temp)
-    return temp
\ No newline at end of file
@@ -0,0 +1,581 @@
+import base64
+from datetime import date
+from itertools import chain
+import json
+import math
+
+from sqlalchemy import and_, event, inspect, or_
+from sqlalchemy.dialects.mysql import match
+
+from cache import search_cache
+from models import Agent, ForSale, House, Rental, db
+from serializers import house_serializer, uuid_str
+
+# number of houses returned per page by /houses/search unless 'limit' is given
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# number of rows fetched from the database at a time when streaming search results
+STREAM_BATCH_SIZE = 500
+
+# keys accepted by the 'sort' parameter of /houses/search. 'relevance' needs a keyword query ('q'), 'distance' a
+# bounding box or a center point
+SORT_KEYS = ['house_id', 'price', '-price', 'create_date', 'rating', 'num_views', 'relevance', 'distance']
+
+# sorts on a single column: sort key -> (column, descending). 'price' is the price column of the listing type (see
+# price_column), the others are House columns. Newest, best rated and most viewed houses come first. Every one of them
+# is served by an index on (column, house_id), so a page only reads about as many index entries as it returns
+SORT_COLUMNS = {
+    'price': ('price', False),
+    '-price': ('price', True),
+    'create_date': ('create_date', True),
+    'rating': ('rating', True),
+    'num_views': ('num_views', True),
+}
+
+# columns searched by the 'q' parameter of /houses/search, covered by the FULLTEXT index ix_houses_fulltext
+FULLTEXT_COLUMNS = ['name', 'description', 'amenities', 'interior_features']
+
+# houses are bucketed into a grid of GEO_CELLS_PER_DEGREE x GEO_CELLS_PER_DEGREE cells per square degree (~11km at
+# 10) so that a map viewport turns into a few ranges of House.geo_cell, one per row of cells
+GEO_CELLS_PER_DEGREE = 10
+GEO_ROW_CELLS = 360 * GEO_CELLS_PER_DEGREE
+# viewports spanning more rows of cells than this are only filtered on latitude/longitude
+MAX_GEO_ROWS = 50
+EARTH_RADIUS_KM = 6371.0
+
+# attribute filters of /houses/search: parameter -> (House column, comparison). The value of 'garage' is true or false
+ATTRIBUTE_FILTERS = {
+    'bedrooms_min': ('bedrooms', '>='),
+    'bathrooms_min': ('bathrooms', '>='),
+    'square_feet_min': ('square_feet', '>='),
+    'square_feet_max': ('square_feet', '<='),
+    'pets': ('pets', '=='),
+    'garage': ('garage', '=='),
+}
+
+# facets the 'facets' parameter of /houses/search can count. Prices are counted per bucket of PRICE_BUCKET_SIZES,
+# labelled with the bucket's lower bound
+FACETS = ['property_type', 'bedrooms', 'price']
+PRICE_BUCKET_SIZES = {'rental': 500, 'for_sale': 50000}
+
+HOUSE_COLUMNS = [attr.key for attr in inspect(House).column_attrs]
+
+# keys that may also be listed in 'fields'. They come from the rentals/for_sale row and are always returned
+PRICE_FIELDS = ['price', 'monthly_price', 'available_start', 'available_end']
+
+
+def price_column(house_type):
+    # the column holding the price for the given type of listing
+    return Rental.monthly_price if house_type == 'rental' else ForSale.price
+
+
+def price_of(house, house_type):
+    if house_type == 'rental':
+        return house.rentals.monthly_price if house.rentals else None
+    return house.for_sale.price if house.for_sale else None
+
+
+def parse_fields(fields):
+    # splits a comma separated 'fields' parameter into names, raises ValueError for unknown fields
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in HOUSE_COLUMNS and name not in PRICE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}.")
+    return names
+
+
+def load_only_fields(fields):
+    # turns a 'fields' parameter into a load_only() option so unrequested columns (e.g. the large Text columns like
+    # description or photos) are neither read from the database nor hydrated. house_id is always loaded
+    names = parse_fields(fields)
+    return db.load_only(House.house_id, *[getattr(House, name) for name in names if name in HOUSE_COLUMNS])
+
+
+def project_fields(data, fields):
+    # keeps only the requested 'fields' (plus house_id and the price fields) of an already serialised house
+    keep = set(parse_fields(fields)) | {'house_id'} | set(PRICE_FIELDS)
+    return {key: value for key, value in data.items() if key in keep}
+
+
+def keyword_match(q):
+    # returns (filter, relevance) for a keyword query. On MySQL this is MATCH ... AGAINST in natural language mode,
+    # answered by the FULLTEXT index and ranked by its relevance score. Other databases (e.g. SQLite for local runs)
+    # fall back to requiring every word in one of the columns with LIKE, which scans the table and isn't ranked
+    # (relevance is None)
+    columns = [getattr(House, name) for name in FULLTEXT_COLUMNS]
+    if db.session.get_bind().dialect.name == 'mysql':
+        relevance = match(*columns, against=q).in_natural_language_mode()
+        return relevance > 0, relevance
+    words = q.split()
+    return and_(*[or_(*[column.contains(word, autoescape=True) for column in columns]) for word in words]), None
+
+
+def geo_cell(latitude, longitude):
+    # grid cell of a coordinate, stored in House.geo_cell. Cells are numbered row by row (south to north, west to east)
+    if latitude is None or longitude is None:
+        return None
+    row = min(int(math.floor((latitude + 90) * GEO_CELLS_PER_DEGREE)), 180 * GEO_CELLS_PER_DEGREE - 1)
+    col = min(int(math.floor((longitude + 180) * GEO_CELLS_PER_DEGREE)), GEO_ROW_CELLS - 1)
+    return row * GEO_ROW_CELLS + col
+
+
+def bbox_filter(bbox):
+    # houses inside bbox = (min_lat, min_lng, max_lat, max_lng). The geo_cell ranges let the database use
+    # ix_houses_geo_cell, the latitude/longitude checks trim the cells at the edges of the box
+    min_lat, min_lng, max_lat, max_lng = bbox
+    criteria = [House.latitude.between(min_lat, max_lat), House.longitude.between(min_lng, max_lng)]
+    first = geo_cell(min_lat, min_lng)
+    last = geo_cell(max_lat, max_lng)
+    rows = range(first // GEO_ROW_CELLS, last // GEO_ROW_CELLS + 1)
+    if len(rows) <= MAX_GEO_ROWS:
+        first_col = first % GEO_ROW_CELLS
+        last_col = last % GEO_ROW_CELLS
+        criteria.append(or_(*[House.geo_cell.between(row * GEO_ROW_CELLS + first_col, row * GEO_ROW_CELLS + last_col)
+                              for row in rows]))
+    return and_(*criteria)
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    # smallest bounding box containing the circle of radius_km around (latitude, longitude)
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlng = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(latitude)), 1e-6)))
+    return max(latitude - dlat, -90.0), max(longitude - dlng, -180.0), min(latitude + dlat, 90.0), \
+        min(longitude + dlng, 180.0)
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    # great-circle (haversine) distance
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def parse_geo(args):
+    # reads the map parameters of /houses/search: 'bbox' (min_lat,min_lng,max_lat,max_lng) or 'lat', 'lng' and
+    # 'radius_km'. Returns (bbox, center, radius_km), all None when no map search is requested. Raises ValueError
+    bbox_str = args.get('bbox')
+    lat = args.get('lat', type=float)
+    lng = args.get('lng', type=float)
+    radius_km = args.get('radius_km', type=float)
+
+    if bbox_str:
+        try:
+            bbox = tuple(float(value) for value in bbox_str.split(','))
+        except ValueError:
+            raise ValueError('bbox must be min_lat,min_lng,max_lat,max_lng.')
+        if len(bbox) != 4 or not -90 <= bbox[0] <= bbox[2] <= 90 or not -180 <= bbox[1] <= bbox[3] <= 180:
+            raise ValueError('bbox must be min_lat,min_lng,max_lat,max_lng.')
+        if lat is not None and lng is not None:
+            return bbox, (lat, lng), None
+        return bbox, ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2), None
+
+    if radius_km is not None:
+        if lat is None or lng is None or not -90 <= lat <= 90 or not -180 <= lng <= 180 or radius_km <= 0:
+            raise ValueError('A radius search needs lat, lng and a positive radius_km.')
+        return radius_bbox(lat, lng, radius_km), (lat, lng), radius_km
+
+    return None, None, None
+
+
+def parse_attribute_filters(args):
+    # reads the ATTRIBUTE_FILTERS parameters that are set into {parameter: value}. Raises ValueError
+    filters = {}
+    for param, (column, _) in ATTRIBUTE_FILTERS.items():
+        value = args.get(param)
+        if value is None or value == '':
+            continue
+        if column == 'pets':
+            filters[param] = value
+        elif column == 'garage':
+            if value.lower() not in ('true', 'false'):
+                raise ValueError(f'{param} must be true or false.')
+            filters[param] = value.lower() == 'true'
+        else:
+            try:
+                filters[param] = int(value)
+            except ValueError:
+                raise ValueError(f'{param} must be an integer.')
+    return filters
+
+
+def attribute_filter(param, value):
+    column, op = ATTRIBUTE_FILTERS[param]
+    column = getattr(House, column)
+    if op == '>=':
+        return column >= value
+    if op == '<=':
+        return column <= value
+    return column == value
+
+
+def parse_facets(facets):
+    # splits a comma separated 'facets' parameter into names, raises ValueError for unknown facets
+    names = [name.strip() for name in facets.split(',') if name.strip()]
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise ValueError(f"Unknown facets: {', '.join(unknown)}.")
+    return names
+
+
+def facet_list(counts):
+    # {value: count} -> [{'value', 'count'}] ordered by value, houses without a value (None) last
+    return [{'value': value, 'count': count}
+            for value, count in sorted(counts.items(), key=lambda item: (item[0] is None, item[0]))]
+
+
+def facet_counts(query, house_type, facets, center=None, radius_km=None):
+    # counts the houses matched by query (built with eager=False) per value of each facet. Every facet is a GROUP BY
+    # over the same filtered rows, sent as a single UNION ALL so the counts take one round trip and no house is loaded.
+    # A radius search's query matches the square around its circle (see radius_bbox): its matches are read and only
+    # those within radius_km of center are counted, the same cut as nearest_page. Returns {facet: facet_list}
+    size = PRICE_BUCKET_SIZES[house_type]
+    counts = {facet: {} for facet in facets}
+    if radius_km is not None:
+        rows = query.with_entities(House.latitude, House.longitude, House.property_type, House.bedrooms,
+                                   price_column(house_type))
+        for latitude, longitude, property_type, bedrooms, price in rows:
+            if distance_km(center[0], center[1], latitude, longitude) > radius_km:
+                continue
+            values = {'property_type': property_type, 'bedrooms': bedrooms,
+                      'price': None if price is None else price - price % size}
+            for facet in facets:
+                counts[facet][values[facet]] = counts[facet].get(values[facet], 0) + 1
+        return {facet: facet_list(values) for facet, values in counts.items()}
+
+    matches = query.with_entities(House.property_type, House.bedrooms, price_column(house_type).label('price')) \
+        .subquery()
+    expressions = {
+        'property_type': matches.c.property_type,
+        'bedrooms': matches.c.bedrooms,
+        'price': matches.c.price - matches.c.price % size,
+    }
+    selects = []
+    for facet in facets:
+        value = db.cast(expressions[facet], db.String)
+        selects.append(db.select(db.literal(facet).label('facet'), value.label('value'), db.func.count().label('count'))
+                       .group_by(value))
+
+    for facet, value, count in db.session.execute(db.union_all(*selects)):
+        if value is not None and facet != 'property_type':
+            value = int(value)
+        counts[facet][value] = count
+    return {facet: facet_list(values) for facet, values in counts.items()}
+
+
+def build_search_query(house_type, property_type=None, city=None, price_min=None, price_max=None, fields=None, q=None,
+                       bbox=None, filters=None, eager=True):
+    # builds the /houses/search query for a validated house_type ('rental' or 'for_sale'). The rental/for_sale row is
+    # loaded by the same JOIN so serialising a result doesn't issue another query per house (unless eager is False).
+    # If fields is given only those House columns are loaded, see load_only_fields. q restricts the results to houses
+    # matching the keywords, bbox to houses inside the bounding box and filters ({parameter: value}, see
+    # parse_attribute_filters) to houses with those attributes
+    query = House.query
+    if q:
+        query = query.filter(keyword_match(q)[0])
+    if bbox:
+        query = query.filter(bbox_filter(bbox))
+    if fields:
+        query = query.options(load_only_fields(fields))
+
+    # Apply filters based on the type of house
+    if house_type == 'rental':
+        query = query.join(Rental)
+        if eager:
+            query = query.options(db.contains_eager(House.rentals))
+    elif house_type == 'for_sale':
+        query = query.join(ForSale)
+        if eager:
+            query = query.options(db.contains_eager(House.for_sale))
+
+    price = price_column(house_type)
+    if price_min is not None:
+        query = query.filter(price >= price_min)
+    if price_max is not None:
+        query = query.filter(price <= price_max)
+
+    if property_type:
+        query = query.filter(House.property_type == property_type)
+
+    if city:
+        query = query.filter(House.city == city)
+
+    for param, value in (filters or {}).items():
+        query = query.filter(attribute_filter(param, value))
+
+    return query
+
+
+def encode_cursor(sort, house, house_type, offset=None):
+    # cursors are opaque to clients: urlsafe base64 of [sort value, house_id hex]. Relevance scores and distances can't
+    # be compared reliably, so those pages store the offset of the next page as their value instead
+    if sort in ('relevance', 'distance'):
+        value = offset
+    elif sort in SORT_COLUMNS:
+        value = sort_value(house, sort, house_type)
+    else:
+        value = None
+    return _cursor(value, house.house_id)
+
+
+def _cursor(value, house_id):
+    raw = json.dumps([value, house_id.hex()]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def sort_value(house, sort, house_type):
+    # value of the SORT_COLUMNS column of house, as stored in cursors. A column left out by 'fields' is read separately
+    # instead of being loaded onto the house, so house_dict still only returns the requested fields
+    name = SORT_COLUMNS[sort][0]
+    if name == 'price':
+        return price_of(house, house_type)
+    if name in house.__dict__:
+        value = house.__dict__[name]
+    else:
+        value = db.session.query(getattr(House, name)).filter(House.house_id == house.house_id).scalar()
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def cursor_value(name, value):
+    # checks the value of a SORT_COLUMNS cursor and converts it back for comparing with column name. None is the value
+    # of a cursor among the houses without a value for the column
+    if value is None:
+        return None
+    if name == 'create_date':
+        if not isinstance(value, str):
+            raise ValueError('Invalid cursor.')
+        return date.fromisoformat(value)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError('Invalid cursor.')
+    return value
+
+
+def next_page_cursor(sort, last_house, house_type, cursor, page_size):
+    # cursor of the page following the one that ended with last_house (and started at cursor)
+    offset = None
+    if sort in ('relevance', 'distance'):
+        offset = cursor_offset(cursor) + page_size
+    return encode_cursor(sort, last_house, house_type, offset)
+
+
+def decode_cursor(cursor):
+    # raises ValueError for a cursor that wasn't produced by encode_cursor
+    try:
+        value, house_id_hex = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, bytes.fromhex(house_id_hex)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor.') from e
+
+
+def cursor_offset(cursor):
+    # offset stored in the cursor of a relevance or distance page, 0 for the first page
+    offset = decode_cursor(cursor)[0] if cursor else 0
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError('Invalid cursor.')
+    return offset
+
+
+def nearest_page(query, house_type, center, radius_km, cursor, page_size, fields=None):
+    # one page of the houses matched by query (built with eager=False) sorted by distance to center, skipping those
+    # further than radius_km. Only the ids and coordinates of the matches are read to rank them, then the page is
+    # loaded with fetch_by_ids. Returns (houses, {house_id: distance}, next_cursor)
+    offset = cursor_offset(cursor)
+    ranked = []
+    for house_id, latitude, longitude in query.with_entities(House.house_id, House.latitude, House.longitude):
+        distance = distance_km(center[0], center[1], latitude, longitude)
+        if radius_km is None or distance <= radius_km:
+            ranked.append((distance, house_id))
+    ranked.sort()
+
+    page = ranked[offset:offset + page_size]
+    houses = fetch_by_ids(house_type, [house_id for _, house_id in page], fields)
+    next_cursor = None
+    if len(ranked) > offset + page_size:
+        # from the ranking: houses deleted since it was read are missing from the loaded page
+        next_cursor = _cursor(offset + page_size, page[-1][1])
+    return houses, {house_id: distance for distance, house_id in page}, next_cursor
+
+
+def order_and_seek(query, house_type, sort, cursor=None, q=None):
+    # orders the query by the sort key (house_id as tie breaker, in the same direction) and, if a cursor is given, only
+    # keeps the rows after it (keyset pagination). Returns a list of queries, the results are their rows read one after
+    # the other (see first_rows). Sorting by one of the SORT_COLUMNS gives two: the houses with a value for the column,
+    # then those without one ordered by house_id, so that each is read in the order of the (column, house_id) index.
+    # Sorting by relevance needs the keyword query q and pages by offset
+    if sort == 'relevance':
+        offset = cursor_offset(cursor)
+        relevance = keyword_match(q)[1]
+        if relevance is not None:
+            query = query.order_by(relevance.desc())
+        return [query.order_by(House.house_id).offset(offset)]
+
+    if sort in SORT_COLUMNS:
+        name, descending = SORT_COLUMNS[sort]
+        if name == 'price':
+            column = price_column(house_type)
+            # the rentals/for_sale house_id, so that both keys come from that table's (price, house_id) index
+            house_id_column = column.class_.house_id
+        else:
+            column = getattr(House, name)
+            house_id_column = House.house_id
+        order = [column.desc(), house_id_column.desc()] if descending else [column, house_id_column]
+        values = query.filter(column.isnot(None)).order_by(*order)
+        nulls = query.filter(column.is_(None)).order_by(order[1])
+        if cursor is None:
+            return [values, nulls]
+        value, house_id = decode_cursor(cursor)
+        value = cursor_value(name, value)
+        after_id = house_id_column < house_id if descending else house_id_column > house_id
+        if value is None:
+            # the cursor is among the houses without a value, every house with one came before it
+            return [nulls.filter(after_id)]
+        after_value = column < value if descending else column > value
+        return [values.filter(or_(after_value, and_(column == value, after_id))), nulls]
+
+    if cursor is not None:
+        _, house_id = decode_cursor(cursor)
+        query = query.filter(House.house_id > house_id)
+    return [query.order_by(House.house_id)]
+
+
+def first_rows(queries, count):
+    # the first count rows of the results of order_and_seek, a query is only run if the ones before it had too few
+    rows = []
+    for query in queries:
+        if len(rows) >= count:
+            break
+        rows += query.limit(count - len(rows)).all()
+    return rows
+
+
+def house_dict(house, house_type=None):
+    # Transform a house object into a dictionary of its loaded columns plus its price attributes. house_type picks the
+    # price attributes to include; if it is None, those of whichever rentals/for_sale row the house has are included
+    data = house_serializer(house)
+
+    # If the house is for rent, include rental attributes directly
+    rental = house.rentals if house_type in (None, 'rental') else None
+    if rental:
+        data['monthly_price'] = rental.monthly_price
+        data['available_start'] = rental.available_start
+        data['available_end'] = rental.available_end
+
+    for_sale = house.for_sale if house_type in (None, 'for_sale') else None
+    if for_sale:
+        data['price'] = for_sale.price
+
+    return data
+
+
+def house_detail_query(house_id):
+    # GET /houses query, the rentals/for_sale row and the agent are loaded by LEFT OUTER JOINs in the same query
+    return House.query.options(
+        db.joinedload(House.rentals),
+        db.joinedload(House.for_sale),
+        db.joinedload(House.agent).joinedload(Agent.user)
+    ).filter_by(house_id=house_id)
+
+
+def house_detail(house):
+    # builds the GET /houses payload (including the agent summary) or returns None if the house doesn't exist
+    if not house:
+        return None
+
+    data = house_dict(house)
+    agent = house.agent
+    data['agent'] = {
+        'user_id': uuid_str(agent.user_id),
+        'first_name': agent.user.first_name,
+        'last_name': agent.user.last_name,
+        'email': agent.user.email,
+        'phone': agent.user.phone,
+        'profile_picture': agent.user.profile_picture,
+        'rating': agent.user.rating,
+        'company_name': agent.company_name,
+    } if agent else None
+    return data
+
+
+def house_view(data, fields=None, include_agent=False):
+    # applies 'fields' and 'include_agent' to a cached GET /houses payload
+    agent = data.get('agent')
+    if fields:
+        data = project_fields(data, fields)
+    data = {key: value for key, value in data.items() if key != 'agent'}
+    if include_agent:
+        data['agent'] = agent
+    return data
+
+
+def house_rows(query, house_type, fields=None):
+    # yields the same dicts as house_dict for the houses of a search query, serialised straight from the result rows
+    # (STREAM_BATCH_SIZE at a time) so no House objects are built. The query's loader options are ignored, fields
+    # picks the columns instead
+    serializer = house_serializer.only(['house_id', *parse_fields(fields)]) if fields else house_serializer
+    if house_type == 'rental':
+        price_keys = ['monthly_price', 'available_start', 'available_end']
+        price_columns = [Rental.monthly_price, Rental.available_start, Rental.available_end]
+    else:
+        price_keys = ['price']
+        price_columns = [ForSale.price]
+
+    split = len(serializer.keys)
+    for row in query.with_entities(*serializer.columns, *price_columns).yield_per(STREAM_BATCH_SIZE):
+        data = serializer.from_row(row[:split])
+        data.update(zip(price_keys, row[split:]))
+        yield data
+
+
+def search_cache_key(house_type, property_type, city, price_min, price_max, sort, cursor, limit, q=None, bbox=None,
+                     filters=None):
+    # normalised filter tuple of a /houses/search page, prefixed with the current generation of search_cache so that
+    # writes to houses/rentals/for_sale invalidate every cached page at once
+    normalised = [house_type, (property_type or '').strip() or None, (city or '').strip() or None, price_min,
+                  price_max, sort, cursor or None, limit, ' '.join((q or '').lower().split()) or None,
+                  list(bbox) if bbox else None, sorted((filters or {}).items())]
+    return f'{search_cache.generation()}:{json.dumps(normalised)}'
+
+
+def ids_query(house_type, house_ids, fields=None):
+    # query loading the given houses of a cached page with one IN (...), see fetch_by_ids
+    return build_search_query(house_type, fields=fields).filter(House.house_id.in_(house_ids))
+
+
+def in_id_order(houses, house_ids):
+    by_id = {house.house_id: house for house in houses}
+    return [by_id[house_id] for house_id in house_ids if house_id in by_id]
+
+
+def fetch_by_ids(house_type, house_ids, fields=None):
+    # hydrates a cached page: loads the given houses with one IN (...) query and returns them in the order of house_ids
+    return in_id_order(ids_query(house_type, house_ids, fields).all(), house_ids)
+
+
+# models whose writes can change search results
+SEARCH_MODELS = (House, Rental, ForSale)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _flag_search_write(session, flush_context):
+    if any(isinstance(obj, SEARCH_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['search_dirty'] = True
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _flag_search_bulk_write(orm_execute_state):
+    # bulk UPDATE/DELETE statements (e.g. Rental.query.filter_by(...).delete()) don't go through the flush
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and orm_execute_state.bind_mapper is not None \
+            and orm_execute_state.bind_mapper.class_ in SEARCH_MODELS:
+        orm_execute_state.session.info['search_dirty'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _bump_search_generation(session):
+    if session.info.pop('search_dirty', False):
+        search_cache.bump()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _clear_search_flag(session):
+    session.info.pop('search_dirty', None)
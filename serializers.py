@@ -0,0 +1,87 @@
+import operator
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import BINARY, inspect
+
+try:
+    import orjson
+except ImportError:  # optional dependency, responses fall back to the json module
+    orjson = None
+
+from models import Agent, House, Saved, User
+
+
+def uuid_str(value):
+    # same as str(uuid.UUID(bytes=value)) without building a UUID object
+    h = value.hex()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+class ModelSerializer:
+    # turns instances of a model, or result rows of self.columns, into dicts of their columns. The key list, the getter
+    # and the uuid (BINARY(16)) columns are worked out once from the column metadata, so serialising a row is a single
+    # C level attribute/item fetch plus the uuid formatting. Other values (dates, ...) are left to the JSON provider
+    def __init__(self, model, exclude=()):
+        self.model = model
+        self.keys = tuple(attr.key for attr in inspect(model).column_attrs if attr.key not in exclude)
+        self.columns = [getattr(model, key) for key in self.keys]
+        self._uuid_keys = tuple(key for key in self.keys
+                                if isinstance(inspect(model).columns[key].type, BINARY))
+        self._attrs = operator.attrgetter(*self.keys)
+        self._items = operator.itemgetter(*self.keys)
+
+    def only(self, keys):
+        # serializer for a subset of the columns (e.g. the 'fields' of a request), in the order of the model
+        return ModelSerializer(self.model, exclude=[key for key in self.keys if key not in keys])
+
+    def from_row(self, row):
+        data = dict(zip(self.keys, row))
+        for key in self._uuid_keys:
+            if data[key] is not None:
+                data[key] = uuid_str(data[key])
+        return data
+
+    def __call__(self, obj):
+        # reads the loaded values straight from the instance dict when every column is loaded, which skips the
+        # attribute instrumentation. Columns deferred by load_only() are left out instead of being loaded
+        loaded = obj.__dict__
+        try:
+            return self.from_row(self._items(loaded))
+        except KeyError:
+            data = {key: loaded[key] for key in self.keys if key in loaded}
+            for key in self._uuid_keys:
+                if data.get(key) is not None:
+                    data[key] = uuid_str(data[key])
+            return data
+
+    def many(self, objs):
+        return [self(obj) for obj in objs]
+
+
+house_serializer = ModelSerializer(House)
+user_serializer = ModelSerializer(User)
+agent_serializer = ModelSerializer(Agent)
+saved_serializer = ModelSerializer(Saved, exclude=('user_id',))
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # Flask's JSON provider with orjson doing the encoding when it is installed. The output matches the default
+    # provider: keys are sorted and dates go through its default() (HTTP dates). Anything orjson rejects (e.g. integers
+    # over 64 bits) is handed to the json module as before
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
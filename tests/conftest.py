@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import uuid
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# the app reads its configuration when it is imported: point it at a throwaway SQLite file and turn on the X-DB-*
+# query count headers (see query_stats.py) before importing it
+_db_dir = tempfile.mkdtemp()
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ['QUERY_STATS_HEADERS'] = 'true'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app  # noqa: E402
+from availability import template_cache  # noqa: E402
+from cache import house_cache, search_cache  # noqa: E402
+from columnar import columnar_index  # noqa: E402
+from models import db  # noqa: E402
+
+
+@event.listens_for(Engine, 'connect')
+def _enforce_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys unless asked to, check them like InnoDB does
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.create_all()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+    for cache in (house_cache, search_cache, template_cache):
+        cache.clear()
+    columnar_index.reset()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def query_count(response):
+    # number of SQL statements the request ran
+    return int(response.headers['X-DB-Query-Count'])
+
+
+def create_user(client, user_type='client'):
+    response = client.post('/users', json={'email': f'{uuid.uuid4().hex}@example.com', 'first_name': 'Test',
+                                           'last_name': 'User', 'user_type': user_type})
+    assert response.status_code in (200, 201), response.json
+    return response.json['data']
+
+
+def create_house(client, agent_id, **fields):
+    data = {'type': 'rentals', 'street': '1 Main St', 'city': 'Austin', 'user_id': agent_id, 'zipcode': 78701,
+            'country': 'US', 'description': 'A house', 'HOA': 0, 'name': 'House', 'price': 1500}
+    data.update(fields)
+    response = client.post('/houses', json=data)
+    assert response.status_code in (200, 201), response.json
+    return response.json['data']
@@ -0,0 +1,84 @@
+import asyncio
+
+from flask import jsonify, request
+
+from async_routes import AsyncApp, async_db
+from conftest import create_house, create_user
+
+
+def scope(path, query_string=''):
+    return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+            'headers': [(b'host', b'testserver')], 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+
+
+def keep_alive(app, requests):
+    # statuses of requests ((path, query string) pairs) sent one after the other like uvicorn does on a keep-alive
+    # connection: each request is started from the send() that ends the response to the one before it
+    asgi_app = AsyncApp(app)
+
+    async def connection():
+        statuses = []
+        done = asyncio.get_running_loop().create_future()
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        def failed(task):
+            if not task.cancelled() and task.exception() is not None and not done.done():
+                done.set_exception(task.exception())
+
+        def start(i):
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif not message.get('more_body'):
+                    if i + 1 < len(requests):
+                        start(i + 1)
+                    else:
+                        done.set_result(statuses)
+
+            asyncio.ensure_future(asgi_app(scope(*requests[i]), receive, send)).add_done_callback(failed)
+
+        start(0)
+        try:
+            return await asyncio.wait_for(done, 10)
+        finally:
+            await async_db.dispose()
+
+    return asyncio.run(connection())
+
+
+def test_flask_requests_after_async_ones_on_a_connection(app, client):
+    agent_id = create_user(client, 'agent')
+    house_id = create_house(client, agent_id)
+    async_view = ('/houses', f'house_id={house_id}')
+    flask_view = ('/users/agents', '')
+    assert keep_alive(app, [flask_view, async_view, flask_view, flask_view, async_view, flask_view]) == [200] * 6
+
+
+def test_availability_on_a_single_connection(app, client, monkeypatch):
+    # without replicas every query of a request shares its connection, a second one could be waited on forever
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_ASYNC_ENGINE_OPTIONS', {'pool_size': 1, 'max_overflow': 0,
+                                                                        'pool_timeout': 1})
+    agent_id = create_user(client, 'agent')
+    house_id = create_house(client, agent_id)
+    assert keep_alive(app, [('/houses/availability', f'house_id={house_id}&date=2030-01-01&days=2')]) == [200]
+
+
+def test_before_request_hooks_run_on_async_views(app, client, monkeypatch):
+    paths = []
+
+    def closed_for_maintenance():
+        paths.append(request.path)
+        if request.path == '/houses':
+            return jsonify({'success': False, 'message': 'Down for maintenance'}), 503
+
+    agent_id = create_user(client, 'agent')
+    house_id = create_house(client, agent_id)
+    monkeypatch.setitem(app.before_request_funcs, None, app.before_request_funcs.get(None, []) +
+                        [closed_for_maintenance])
+    statuses = keep_alive(app, [('/houses', f'house_id={house_id}'),
+                                ('/houses/availability', f'house_id={house_id}&date=2030-01-01&days=2')])
+    assert statuses == [503, 200]
+    assert paths == ['/houses', '/houses/availability']
@@ -0,0 +1,127 @@
+from datetime import date, time
+import uuid
+
+import pytest
+
+from conftest import create_house, create_user, query_count
+from availability import cache_templates, template_cache, templates_statement
+from models import Appointment, ListingAvailability, db
+
+MONDAY = date(2030, 5, 6)
+
+
+@pytest.fixture
+def house(app, client):
+    agent_id = create_user(client, 'agent')
+    client_id = create_user(client)
+    house_id = create_house(client, agent_id)
+    house = uuid.UUID(house_id).bytes
+    with app.app_context():
+        # every Monday 09:00-10:00, overridden by 14:00-15:00 on the second Monday, one appointment on the first
+        db.session.add_all([
+            ListingAvailability(pattern_id=uuid.uuid4().bytes, house_id=house, day_of_the_week=0,
+                                start_time=time(9), end_time=time(10), is_recurring=True),
+            ListingAvailability(pattern_id=uuid.uuid4().bytes, house_id=house, available_date=date(2030, 5, 13),
+                                start_time=time(14), end_time=time(15), is_recurring=False),
+            Appointment(appt_id=uuid.uuid4().bytes, house_id=house, user_id=uuid.UUID(client_id).bytes,
+                        date=MONDAY, start_time=time(9, 15), end_time=time(9, 30)),
+        ])
+        db.session.commit()
+    return house_id
+
+
+def availability(client, house_id, days):
+    return client.get(f'/houses/availability?house_id={house_id}&date={MONDAY.isoformat()}&days={days}')
+
+
+def test_grid(client, house):
+    response = availability(client, house, 8)
+    assert response.status_code == 200
+    grid = response.json['data']
+    assert list(grid) == [date(2030, 5, 6 + x).isoformat() for x in range(8)]
+    assert grid['2030-05-06'] == ['09:00 Free', '09:15 Booked', '09:30 Free', '09:45 Free']
+    assert grid['2030-05-07'] == []
+    assert grid['2030-05-13'] == ['14:00 Free', '14:15 Free', '14:30 Free', '14:45 Free']
+
+
+@pytest.mark.parametrize('days', [3, 60])
+def test_query_count_independent_of_days(client, house, days):
+    # house lookup + templates + appointments when the template isn't cached yet, then only the template is reused
+    cold = availability(client, house, days)
+    warm = availability(client, house, days)
+    assert cold.status_code == warm.status_code == 200
+    assert len(cold.json['data']) == days
+    assert query_count(cold) == 3
+    assert query_count(warm) == 2
+
+
+def move_window(app, house_id, start, end):
+    # changes the recurring window behind the app's back, like another worker or a manual UPDATE would
+    with app.app_context():
+        ListingAvailability.query.filter_by(house_id=uuid.UUID(house_id).bytes, day_of_the_week=0) \
+            .update({'start_time': start, 'end_time': end})
+        db.session.commit()
+
+
+def first_block(client, house_id):
+    return availability(client, house_id, 1).json['data'][MONDAY.isoformat()][0]
+
+
+def test_template_expires(app, client, house, monkeypatch):
+    assert first_block(client, house) == '09:00 Free'
+    move_window(app, house, time(14), time(15))
+    # within the ttl the cached template is still used
+    assert first_block(client, house) == '09:00 Free'
+
+    template_cache.clear()
+    monkeypatch.setattr(template_cache, 'ttl', 0)
+    assert first_block(client, house) == '14:00 Free'
+    move_window(app, house, time(16), time(17))
+    assert first_block(client, house) == '16:00 Free'
+
+
+def test_template_dropped_by_other_worker_invalidation(app, client, house):
+    assert first_block(client, house) == '09:00 Free'
+    move_window(app, house, time(14), time(15))
+    # another worker sharing the (redis) generations invalidated the template of another house, then of this one
+    template_cache.versions.bump(uuid.uuid4().hex)
+    assert first_block(client, house) == '09:00 Free'
+    template_cache.versions.bump(uuid.UUID(house).hex)
+    assert first_block(client, house) == '14:00 Free'
+
+
+def test_invalidation_keeps_other_houses_cached(app, client, house):
+    other = create_house(client, create_user(client, 'agent'))
+    house_ids = [uuid.UUID(house).bytes, uuid.UUID(other).bytes]
+    with app.app_context():
+        templates, missing, generation = template_cache.get_many(house_ids)
+        cache_templates(missing, [], generation)
+        template_cache.invalidate(house_ids[0])
+        templates, missing, _ = template_cache.get_many(house_ids)
+    assert missing == house_ids[:1]
+    assert list(templates) == house_ids[1:]
+
+
+def test_template_loaded_before_invalidation_not_served(app, house):
+    house_id = uuid.UUID(house).bytes
+    with app.app_context():
+        _, missing, generation = template_cache.get_many([house_id])
+        assert missing == [house_id]
+        patterns = db.session.execute(templates_statement(missing)).scalars().all()
+        # a write commits and invalidates while the rows above are being turned into a template
+        template_cache.invalidate(house_id)
+        cache_templates(missing, patterns, generation)
+        _, missing, _ = template_cache.get_many([house_id])
+        assert missing == [house_id]
+
+
+def test_batch_limits(client, house):
+    def batch(house_ids, days):
+        return client.get(f'/houses/availability/batch?house_ids={",".join(house_ids)}&date={MONDAY.isoformat()}'
+                          f'&days={days}')
+
+    assert batch([house], 90).status_code == 200
+    response = batch([house], 91)
+    assert response.status_code == 400
+    assert response.json['message'] == 'At most 90 days can be requested at once.'
+    assert batch([house] + [str(uuid.uuid4()) for _ in range(100)], 1).status_code == 400
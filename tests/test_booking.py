@@ -0,0 +1,125 @@
+from datetime import date, datetime, timedelta
+import threading
+import time
+import uuid
+
+from conftest import create_house, create_user
+from models import Appointment, AppointmentSlot
+
+DAY = date(2030, 5, 6)
+
+
+def book(client, user_id, house_id, start_time):
+    return client.post('/houses/appointment', json={'user_id': user_id, 'house_id': house_id,
+                                                    'date': DAY.isoformat(), 'start_time': start_time})
+
+
+def booked(app, house_id):
+    with app.app_context():
+        return sorted((appt.start_time, appt.end_time) for appt in
+                      Appointment.query.filter_by(house_id=uuid.UUID(house_id).bytes).all())
+
+
+def assert_no_overlaps(appointments):
+    for (start, end), (next_start, _) in zip(appointments, appointments[1:]):
+        assert end <= next_start, f'{start}-{end} overlaps an appointment at {next_start}'
+
+
+def test_bookings_start_on_the_grid(app, client):
+    user_id = create_user(client)
+    house_id = create_house(client, create_user(client, 'agent'))
+    assert book(client, user_id, house_id, '10:00:00').status_code == 201
+    assert book(client, user_id, house_id, '10:00:00').status_code == 403
+    # back to back with the first one
+    assert book(client, user_id, house_id, '10:15:00').status_code == 201
+    for start in ['10:07:00', '09:50:00', '11:00:30']:
+        response = book(client, user_id, house_id, start)
+        assert response.status_code == 400
+        assert response.json['message'] == 'Appointments start on the hour or at :15, :30 or :45.'
+    assert_no_overlaps(booked(app, house_id))
+
+
+def test_cancelled_blocks_are_released(app, client):
+    user_id = create_user(client)
+    house_id = create_house(client, create_user(client, 'agent'))
+    assert book(client, user_id, house_id, '10:00:00').status_code == 201
+    appt_id = client.get(f'/houses/appointment?house_id={house_id}').json['data'][0]['appt_id']
+    assert client.delete(f'/houses/appointment?appt_id={appt_id}').status_code == 200
+    assert book(client, user_id, house_id, '10:00:00').status_code == 201
+    with app.app_context():
+        assert AppointmentSlot.query.count() == 1
+
+
+def test_delete_house_with_appointments(app, client):
+    user_id = create_user(client)
+    house_id = create_house(client, create_user(client, 'agent'))
+    assert book(client, user_id, house_id, '10:15:00').status_code == 201
+    assert client.delete(f'/houses?house_id={house_id}').status_code == 200
+    with app.app_context():
+        assert AppointmentSlot.query.count() == 0
+
+
+def test_bulk_overlaps_and_off_grid_start_times(app, client):
+    user_id = create_user(client)
+    house_id = create_house(client, create_user(client, 'agent'))
+    assert book(client, user_id, house_id, '10:00:00').status_code == 201
+    items = [{'user_id': user_id, 'house_id': house_id, 'date': DAY.isoformat(), 'start_time': start}
+             for start in ['10:00:00', '11:00:00', '11:10:00', '11:00:00', '11:15:00']]
+    response = client.post('/houses/appointment/bulk', json={'appointments': items})
+    assert response.status_code == 201
+    assert [result['message'] for result in response.json['data']] == [
+        'Overlaps with existing appointment.', 'Appointment created successfully!',
+        'Appointments start on the hour or at :15, :30 or :45.', 'Overlaps with existing appointment.',
+        'Appointment created successfully!']
+    assert_no_overlaps(booked(app, house_id))
+
+
+def test_concurrent_bookings_never_overlap(app):
+    # every thread tries to book every quarter hour between 08:00 and 20:00 of the same house, in a different order, so
+    # that bookings of the same blocks race each other
+    threads = 8
+    setup = app.test_client()
+    user_id = create_user(setup)
+    house_id = create_house(setup, create_user(setup, 'agent'))
+    starts = [(datetime(2000, 1, 1, 8) + timedelta(minutes=15 * n)).strftime('%H:%M:%S') for n in range(48)]
+    barrier = threading.Barrier(threads)
+    statuses = []
+    errors = []
+
+    def worker(n):
+        client = app.test_client()
+        barrier.wait()
+        try:
+            for start in starts[n:] + starts[:n]:
+                statuses.append(book(client, user_id, house_id, start).status_code)
+        except Exception as e:
+            errors.append(e)
+
+    begin = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+
+    assert not errors
+    appointments = booked(app, house_id)
+    assert_no_overlaps(appointments)
+    assert statuses.count(201) == len(appointments) > 0
+    assert set(statuses) <= {201, 403}
+    print(f'{len(statuses)} bookings in {elapsed:.2f}s ({len(statuses) / elapsed:.0f} req/s), '
+          f'{len(appointments)} created')
+
+
+def test_bulk_invalid_items(client):
+    user_id = create_user(client)
+    house_id = create_house(client, create_user(client, 'agent'))
+    item = {'user_id': user_id, 'house_id': house_id, 'date': DAY.isoformat(), 'start_time': '10:00:00'}
+    items = [dict(item, user_id=123), dict(item, name=5), dict(item, description=['x']), dict(item, date=None),
+             dict(item, name='x' * 255), item]
+    response = client.post('/houses/appointment/bulk', json={'appointments': items})
+    assert response.status_code == 201
+    assert [result['message'] for result in response.json['data']] == [
+        'Invalid input format.', 'Invalid input format.', 'Invalid input format.', 'Invalid input format.',
+        'Name too long.', 'Appointment created successfully!']
@@ -0,0 +1,16 @@
+import pytest
+
+from conftest import create_house, create_user
+
+
+@pytest.mark.parametrize('key, max_length', [('city', 100), ('property_type', 50)])
+def test_bounded_columns(client, key, max_length):
+    agent_id = create_user(client, 'agent')
+    create_house(client, agent_id, **{key: 'x' * max_length})
+
+    data = {'type': 'rentals', 'street': '1 Main St', 'city': 'Austin', 'user_id': agent_id, 'zipcode': 78701,
+            'country': 'US', 'description': 'A house', 'HOA': 0, 'name': 'House', 'price': 1500,
+            key: 'x' * (max_length + 1)}
+    response = client.post('/houses', json=data)
+    assert response.status_code == 400
+    assert response.json['message'] == f'{key} must be at most {max_length} characters.'
@@ -0,0 +1,242 @@
+from datetime import date
+import json
+import random
+import uuid
+
+import pytest
+
+from cache import search_cache
+from columnar import WRITE_VERSION_KEY, columnar_index
+from conftest import create_house, create_user
+from models import ForSale, House, Rental, db
+from search import SORT_COLUMNS, fetch_by_ids, radius_bbox
+
+
+@pytest.fixture(params=['sql', 'columnar'])
+def engine(request, monkeypatch):
+    # runs a test against both search engines (SEARCH_ENGINE)
+    monkeypatch.setattr(columnar_index, 'enabled', request.param == 'columnar')
+    return request.param
+
+
+def walk(client, **params):
+    # house_ids of every page of a search, following next_cursor
+    house_ids = []
+    cursor = None
+    while True:
+        response = client.get('/houses/search', query_string=dict(params, cursor=cursor) if cursor else params)
+        assert response.status_code == 200, response.json
+        house_ids += [house['house_id'] for house in response.json['data']]
+        cursor = response.json['next_cursor']
+        if cursor is None:
+            return house_ids
+
+
+def update_house(app, house_id, **values):
+    with app.app_context():
+        House.query.filter_by(house_id=uuid.UUID(house_id).bytes).update(values)
+        db.session.commit()
+
+
+@pytest.mark.parametrize('limit', [1, 2, 10])
+def test_sort_keeps_houses_without_value(app, client, engine, limit):
+    agent_id = create_user(client, 'agent')
+    dated = [create_house(client, agent_id) for _ in range(2)]
+    for day, house_id in enumerate(dated, 1):
+        update_house(app, house_id, create_date=date(2030, 1, day))
+    undated = sorted(create_house(client, agent_id) for _ in range(3))
+    # newest first, then the houses without a create_date in (descending) house_id order
+    assert walk(client, type='rental', sort='create_date', limit=limit) == dated[::-1] + undated[::-1]
+
+
+def test_price_sort_keeps_houses_without_price(client, engine):
+    agent_id = create_user(client, 'agent')
+    priced = [create_house(client, agent_id, price=price) for price in (900, 700)]
+    unpriced = sorted(create_house(client, agent_id, price=None) for _ in range(2))
+    expected = priced[::-1] + unpriced
+    assert walk(client, type='rental', sort='price', limit=1) == expected
+
+    response = client.get('/houses/search?type=rental&sort=price&format=ndjson')
+    assert [line['house_id'] for line in map(json.loads, response.text.splitlines())] == expected
+
+
+def test_columnar_index_outlives_expired_cache(client, monkeypatch):
+    monkeypatch.setattr(columnar_index, 'enabled', True)
+    agent_id = create_user(client, 'agent')
+    house_ids = [create_house(client, agent_id) for _ in range(3)]
+    loads = []
+    load = columnar_index._load
+    monkeypatch.setattr(columnar_index, '_load', lambda house_ids=None: loads.append(house_ids) or load(house_ids))
+    assert sorted(walk(client, type='rental', limit=2)) == sorted(house_ids)
+    assert loads == [None]
+
+    # the search_cache entries (generations included) expire without any write: the index is kept
+    search_cache.clear()
+    assert sorted(walk(client, type='rental', limit=2)) == sorted(house_ids)
+    assert loads == [None]
+
+    # a write of this worker only re-reads its house
+    house_ids.append(create_house(client, agent_id))
+    search_cache.clear()
+    assert sorted(walk(client, type='rental', limit=2)) == sorted(house_ids)
+    assert loads == [None, {uuid.UUID(house_ids[-1]).bytes}]
+
+    # another worker wrote
+    search_cache.bump(WRITE_VERSION_KEY)
+    walk(client, type='rental', price_min=1)
+    assert loads[-1] is None
+
+    # more than a TTL since the last search: a write by another worker may have expired unseen
+    del loads[:]
+    search_cache.clear()
+    columnar_index._checked -= search_cache.backend.ttl
+    walk(client, type='rental', price_min=2)
+    assert loads == [None]
+
+    # the writes of other workers never show up in the memory cache: an index older than max_age is reloaded anyway
+    del loads[:]
+    columnar_index._loaded -= columnar_index.max_age
+    walk(client, type='rental', price_min=3)
+    assert loads == [None]
+    walk(client, type='rental', price_min=4)
+    assert loads == [None]
+
+
+def test_columnar_index_answers_during_a_reload(client, monkeypatch):
+    monkeypatch.setattr(columnar_index, 'enabled', True)
+    agent_id = create_user(client, 'agent')
+    house_ids = [create_house(client, agent_id) for _ in range(2)]
+    assert sorted(walk(client, type='rental')) == sorted(house_ids)
+
+    # another search is reloading: this one doesn't wait for it and answers from the current arrays
+    search_cache.bump(WRITE_VERSION_KEY)
+    monkeypatch.setattr(columnar_index, '_load', lambda house_ids=None: pytest.fail('loaded twice'))
+    with columnar_index._update_lock:
+        assert sorted(walk(client, type='rental')) == sorted(house_ids)
+
+
+def test_columnar_index_updates_house_ids_ending_in_nul(app, client, monkeypatch):
+    monkeypatch.setattr(columnar_index, 'enabled', True)
+    agent_id = create_user(client, 'agent')
+    other_id = create_house(client, agent_id)
+    monkeypatch.setattr(uuid, 'uuid4', lambda: uuid.UUID(bytes=bytes(range(1, 16)) + b'\0'))
+    house_id = create_house(client, agent_id)
+    assert sorted(walk(client, type='rental')) == sorted([other_id, house_id])
+
+    # the index re-reads the house
+    with app.app_context():
+        db.session.get(House, uuid.UUID(house_id).bytes).rentals.monthly_price = 900
+        db.session.commit()
+    search_cache.clear()
+    assert walk(client, type='rental', sort='price') == [house_id, other_id]
+
+
+def test_columnar_facets_keep_the_case_of_folded_values(client, monkeypatch):
+    # on MySQL the codes are keyed on casefolded values, the facets still show the values as stored
+    monkeypatch.setattr(columnar_index, 'enabled', True)
+    monkeypatch.setattr(columnar_index, '_key', lambda value: value.casefold() if isinstance(value, str) else value)
+    columnar_index.reset()
+    agent_id = create_user(client, 'agent')
+    create_house(client, agent_id, property_type='Townhouse')
+    response = client.get('/houses/search', query_string={'type': 'rental', 'property_type': 'TOWNHOUSE',
+                                                           'facets': 'property_type'})
+    assert response.json['facets'] == {'property_type': [{'value': 'Townhouse', 'count': 1}]}
+
+
+def test_radius_facets_count_the_circle(client):
+    agent_id = create_user(client, 'agent')
+    near = create_house(client, agent_id, latitude=30.0, longitude=-97.0, property_type='condo', bedrooms=2, price=1200)
+    # inside the square around the 10 km circle, about 12 km from its center
+    create_house(client, agent_id, latitude=30.08, longitude=-96.92, property_type='house', bedrooms=3, price=2600)
+    params = {'type': 'rental', 'facets': 'property_type,bedrooms,price'}
+
+    response = client.get('/houses/search', query_string=dict(params, lat=30.0, lng=-97.0, radius_km=10))
+    assert [house['house_id'] for house in response.json['data']] == [near]
+    assert response.json['facets'] == {'property_type': [{'value': 'condo', 'count': 1}],
+                                       'bedrooms': [{'value': 2, 'count': 1}],
+                                       'price': [{'value': 1000, 'count': 1}]}
+
+    # the bbox of that square counts both
+    bbox = ','.join(map(str, radius_bbox(30.0, -97.0, 10)))
+    response = client.get('/houses/search', query_string=dict(params, bbox=bbox))
+    assert response.json['facets']['bedrooms'] == [{'value': 2, 'count': 1}, {'value': 3, 'count': 1}]
+
+
+def test_radius_pages_survive_deleted_houses(client, monkeypatch):
+    agent_id = create_user(client, 'agent')
+    house_ids = [create_house(client, agent_id, latitude=30.0, longitude=-97.0 + i * 0.01) for i in range(2)]
+    params = {'type': 'rental', 'lat': 30.0, 'lng': -97.0, 'radius_km': 10, 'limit': 1}
+
+    # the first house is deleted between the ranking and the loading of its page
+    monkeypatch.setattr('search.fetch_by_ids', lambda house_type, house_ids, fields=None: [])
+    response = client.get('/houses/search', query_string=params)
+    assert response.status_code == 200
+    assert response.json['data'] == []
+
+    monkeypatch.setattr('search.fetch_by_ids', fetch_by_ids)
+    response = client.get('/houses/search', query_string=dict(params, cursor=response.json['next_cursor']))
+    assert [house['house_id'] for house in response.json['data']] == house_ids[1:]
+
+
+# filters of the engine parity test, each walked with every sort
+PARITY_FILTERS = [{}, {'city': 'Austin'}, {'property_type': 'condo', 'bedrooms_min': 2},
+                  {'price_min': 1000, 'price_max': 400000}, {'pets': 'yes', 'garage': 'true'}]
+
+
+def assert_engines_agree(client, monkeypatch):
+    # every page of every PARITY_FILTERS search, for both listing types and every sort, is the same with both engines.
+    # The index stays enabled in between so that it follows the writes like it would in production
+    for house_type in ['rental', 'for_sale']:
+        for sort in ['house_id', *SORT_COLUMNS]:
+            for filters in PARITY_FILTERS:
+                results = []
+                for enabled in (False, True):
+                    monkeypatch.setattr(columnar_index, 'enabled', enabled)
+                    search_cache.clear()
+                    results.append(walk(client, type=house_type, sort=sort, limit=4, **filters))
+                monkeypatch.setattr(columnar_index, 'enabled', True)
+                assert results[0] == results[1], (house_type, sort, filters)
+
+
+def test_columnar_matches_sql(app, client, monkeypatch):
+    monkeypatch.setattr(columnar_index, 'enabled', True)
+    rng = random.Random(0)
+    agent_id = create_user(client, 'agent')
+
+    def add_houses(count):
+        for _ in range(count):
+            rental = rng.random() < 0.5
+            create_house(client, agent_id, type='rentals' if rental else 'for_sale',
+                         city=rng.choice(['Austin', 'austin', 'Boston']),
+                         property_type=rng.choice(['condo', 'house', None]),
+                         price=rng.choice([None, rng.randrange(500, 3000) if rental else rng.randrange(1, 9) * 100000]),
+                         bedrooms=rng.choice([None, 1, 2, 3]), rating=rng.choice([None, 1, 3, 5]),
+                         num_views=rng.choice([None, 0, 10]), pets=rng.choice([None, 'yes', 'no']),
+                         garage=rng.choice([None, True, False]))
+
+    def update_houses(fraction):
+        # ORM updates, which the index re-reads house by house
+        with app.app_context():
+            for house in House.query.all():
+                if rng.random() < fraction:
+                    house.create_date = rng.choice([None, date(2030, 1, rng.randrange(1, 4))])
+                    house.rating = rng.choice([None, 2, 3])
+                    house.city = rng.choice(['Austin', 'Boston'])
+                    if house.rentals is not None:
+                        house.rentals.monthly_price = rng.choice([None, 1500, 2500])
+            db.session.commit()
+
+    add_houses(30)
+    update_houses(0.5)
+    assert_engines_agree(client, monkeypatch)
+
+    add_houses(10)
+    update_houses(0.3)
+    assert_engines_agree(client, monkeypatch)
+
+    # bulk deletes, after which the index is rebuilt
+    with app.app_context():
+        Rental.query.filter(Rental.monthly_price < 2000).delete()
+        ForSale.query.filter(ForSale.price > 500000).delete()
+        db.session.commit()
+    assert_engines_agree(client, monkeypatch)
@@ -0,0 +1,25 @@
+import pytest
+
+from conftest import create_house, create_user, query_count
+
+
+@pytest.mark.parametrize('user_type, path', [('agent', '/users/agents'), ('client', '/users/clients')])
+@pytest.mark.parametrize('rows', [3, 120])
+def test_query_count_independent_of_rows(client, user_type, path, rows):
+    # the users are loaded by the same JOIN, a full page and a short one both take a single query
+    for _ in range(rows):
+        create_user(client, user_type)
+    response = client.get(f'{path}?limit=100')
+    assert response.status_code == 200
+    assert len(response.json['data']) == min(rows, 100)
+    assert query_count(response) == 1
+
+
+def test_deleting_an_agent_drops_it_from_cached_houses(client):
+    agent_id = create_user(client, 'agent')
+    house_id = create_house(client, agent_id)
+    house = client.get(f'/houses?house_id={house_id}&include_agent=true').json['data']
+    assert house['agent']['user_id'] == agent_id
+
+    assert client.delete(f'/users?user_id={agent_id}').status_code == 200
+    assert client.get(f'/houses?house_id={house_id}&include_agent=true').json['data']['agent'] is None
@@ -0,0 +1,4 @@
+# production entry point, served by gunicorn with the settings in gunicorn.conf.py:
+#     gunicorn -c gunicorn.conf.py wsgi:app
+# `python app.py` stays the local development server
+from app import app